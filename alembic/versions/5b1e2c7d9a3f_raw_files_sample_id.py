@@ -0,0 +1,52 @@
+"""Add indexed sample_id column to raw_files
+
+Revision ID: 5b1e2c7d9a3f
+Revises: 4086b4204091
+Create Date: 2026-10-17 09:12:41.203118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e2c7d9a3f'
+down_revision: Union[str, None] = '4086b4204091'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('raw_files', sa.Column('sample_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_raw_files_sample_id', 'raw_files', 'samples', ['sample_id'], ['id'])
+    op.create_index(op.f('ix_raw_files_sample_id'), 'raw_files', ['sample_id'], unique=False)
+    # Backfill from the raw_files_metadata rows that used to hold the link.
+    # Any string used to be accepted there, so only values that are plain
+    # integers are cast; anything else would abort the migration.
+    op.execute('''
+        UPDATE raw_files
+        SET sample_id = (
+            SELECT CAST(rfm.metadata_value AS INTEGER)
+            FROM raw_files_metadata rfm
+            WHERE rfm.raw_file_id = raw_files.id AND rfm.metadata_key = 'sample_id'
+              AND rfm.metadata_value ~ '^[0-9]{1,9}$'
+            ORDER BY rfm.metadata_id
+            LIMIT 1
+        )
+        WHERE sample_id IS NULL
+    ''')
+    # Nothing keeps the old rows in step with the column any more
+    op.execute("DELETE FROM raw_files_metadata WHERE metadata_key = 'sample_id'")
+
+
+def downgrade() -> None:
+    op.execute('''
+        INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value)
+        SELECT id, 'sample_id', CAST(sample_id AS TEXT) FROM raw_files
+        WHERE sample_id IS NOT NULL
+    ''')
+    op.drop_index(op.f('ix_raw_files_sample_id'), table_name='raw_files')
+    op.drop_constraint('fk_raw_files_sample_id', 'raw_files', type_='foreignkey')
+    op.drop_column('raw_files', 'sample_id')
@@ -0,0 +1,48 @@
+"""Make raw files unique on (dataset_id, path) and their metadata on key
+
+Revision ID: 7c3d9e1f2a4b
+Revises: 5b1e2c7d9a3f
+Create Date: 2026-10-17 14:02:19.540311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3d9e1f2a4b'
+down_revision: Union[str, None] = '5b1e2c7d9a3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Merge files inserted more than once by repeated tracker runs
+    op.execute('''
+        UPDATE raw_files_metadata
+        SET raw_file_id = (
+            SELECT MIN(keep.id) FROM raw_files keep
+            JOIN raw_files dup ON dup.dataset_id = keep.dataset_id AND dup.path IS NOT DISTINCT FROM keep.path
+            WHERE dup.id = raw_files_metadata.raw_file_id
+        )
+        WHERE raw_file_id IN (SELECT id FROM raw_files)
+          AND raw_file_id NOT IN (SELECT MIN(id) FROM raw_files GROUP BY dataset_id, path)
+    ''')
+    op.execute('''
+        DELETE FROM raw_files
+        WHERE id NOT IN (SELECT MIN(id) FROM raw_files GROUP BY dataset_id, path)
+    ''')
+    op.execute('''
+        DELETE FROM raw_files_metadata
+        WHERE metadata_id NOT IN (
+            SELECT MAX(metadata_id) FROM raw_files_metadata GROUP BY raw_file_id, metadata_key
+        )
+    ''')
+    op.create_index('uq_raw_files_dataset_path', 'raw_files', ['dataset_id', 'path'], unique=True)
+    op.create_index('uq_raw_files_metadata_file_key', 'raw_files_metadata', ['raw_file_id', 'metadata_key'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('uq_raw_files_metadata_file_key', table_name='raw_files_metadata')
+    op.drop_index('uq_raw_files_dataset_path', table_name='raw_files')
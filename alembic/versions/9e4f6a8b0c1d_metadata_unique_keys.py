@@ -0,0 +1,38 @@
+"""Make metadata keys unique per dataset, patient and sample
+
+Revision ID: 9e4f6a8b0c1d
+Revises: 7c3d9e1f2a4b
+Create Date: 2026-10-17 15:37:04.118206
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4f6a8b0c1d'
+down_revision: Union[str, None] = '7c3d9e1f2a4b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = [
+    ('datasets_metadata', 'dataset_id'),
+    ('patients_metadata', 'patient_id'),
+    ('samples_metadata', 'sample_id'),
+]
+
+
+def upgrade() -> None:
+    for table, entity_id in TABLES:
+        # Keep the newest value of keys that were stored more than once
+        op.execute(f'''
+            DELETE FROM {table}
+            WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {entity_id}, key)
+        ''')
+        op.create_index(f'uq_{table}_{entity_id}_key', table, [entity_id, 'key'], unique=True)
+
+
+def downgrade() -> None:
+    for table, entity_id in TABLES:
+        op.drop_index(f'uq_{table}_{entity_id}_key', table_name=table)
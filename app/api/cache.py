@@ -0,0 +1,127 @@
+import threading
+from collections import OrderedDict
+
+from fastapi.responses import Response
+
+from app.api.coalesce import single_flight
+
+# Headers that are recomputed when a cached body is sent again
+_SKIPPED_HEADERS = {"content-length", "content-type"}
+
+
+class ResponseCache:
+    """
+    LRU cache of rendered GET responses keyed on route path and query params.
+
+    Each entry carries tags such as ("dataset", 3) so that write endpoints can
+    invalidate exactly the entries they affect. Writes made outside the API
+    (the import scripts) are detected through SQLite's PRAGMA data_version on
+    the pool's writer connection, which only changes when another connection
+    commits; any such change clears the whole cache. The pool publishes that
+    value in the background, so a hit costs no database round trip. Concurrent misses for the
+    same key share one build through single_flight.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._size = 0
+        self._generation = 0
+        self._data_version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(request):
+        return request.url.path, tuple(sorted(request.query_params.multi_items()))
+
+    async def fetch(self, request, db, tags, build, etag=None):
+        """
+        Return the cached response for request, or await build() and cache it.
+
+        build must return a rendered Response; its body and headers are stored.
+        With etag the entry is only served under that ETag: another process
+        may have changed the rows before the data_version poll noticed, and a
+        body cached under an older ETag then counts as a miss.
+        """
+        self.check_data_version(db)
+        key = self.key(request)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[4] != etag:
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+            generation = self._generation
+        if entry is not None:
+            body, media_type, headers, _, _ = entry
+            return Response(body, media_type=media_type, headers=headers)
+
+        async def build_and_store():
+            response = await build()
+            headers = {
+                name: value for name, value in response.headers.items()
+                if name not in _SKIPPED_HEADERS
+            }
+            self._put(key, (response.body, response.media_type, headers, tuple(tags), etag), generation)
+            return response
+
+        return await single_flight.fetch((key, generation, etag), build_and_store)
+
+    def _put(self, key, entry, generation):
+        size = len(entry[0])
+        with self._lock:
+            # Skip results that were computed while an invalidation happened
+            if generation != self._generation or size > self.max_bytes:
+                return
+            if key in self._entries:
+                if self._entries[key][4] == entry[4]:
+                    return
+                # Built under another ETag; the newer build replaces it
+                self._remove(key)
+            self._entries[key] = entry
+            self._size += size
+            for tag in entry[3]:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= len(entry[0])
+        for tag in entry[3]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, *tags):
+        single_flight.detach()
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        single_flight.detach()
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+            self._size = 0
+
+    def check_data_version(self, db):
+        version = db.data_version()
+        if version is None:
+            # The writer thread has not published it yet
+            return
+        if version != self._data_version:
+            if self._data_version is not None:
+                self.clear()
+            self._data_version = version
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,60 @@
+import asyncio
+
+from fastapi.responses import Response
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent GET requests onto one in-flight build.
+
+    The first request for a key (the leader) starts build() as a task; requests
+    for the same key that arrive while it is running await that task instead
+    of running the query again, and every caller gets its own Response built
+    from the shared body. The task is shielded so a leader whose client goes
+    away does not cancel the work the others are waiting on.
+
+    Only requests that arrive while the build is running are coalesced;
+    detach() is called on writes so that requests made after a write start a
+    fresh build rather than joining one that may have read the old rows.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def fetch(self, key, build):
+        """Return a Response for key, sharing a running build() if there is one."""
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, build))
+            self._flights[key] = task
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        body, media_type, headers = await asyncio.shield(task)
+        return Response(body, media_type=media_type, headers=headers)
+
+    async def _run(self, key, build):
+        try:
+            response = await build()
+            return response.body, response.media_type, dict(response.headers)
+        finally:
+            # A newer flight may have replaced this one after detach()
+            if self._flights.get(key) is asyncio.current_task():
+                del self._flights[key]
+
+    def detach(self):
+        self._flights.clear()
+
+    def stats(self):
+        total = self.leaders + self.coalesced
+        return {
+            'in_flight': len(self._flights),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+            'coalesced_ratio': self.coalesced / total if total else 0.0,
+        }
+
+
+single_flight = SingleFlight()
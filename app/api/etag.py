@@ -0,0 +1,59 @@
+from fastapi.responses import Response
+
+# change_versions tables each route's response is built from
+PATIENTS_TABLES = ('patients', 'samples')
+PATIENTS_METADATA_TABLES = ('patients', 'patients_metadata', 'samples', 'samples_metadata')
+SAMPLES_TABLES = ('patients', 'samples', 'samples_metadata')
+
+
+def _change_versions(conn, project_id, tables):
+    placeholders = ", ".join("?" for _ in tables)
+    if project_id is None:
+        rows = conn.execute(f'''
+            SELECT table_name, SUM(version) FROM change_versions
+            WHERE table_name IN ({placeholders})
+            GROUP BY table_name
+        ''', tables).fetchall()
+    else:
+        rows = conn.execute(f'''
+            SELECT table_name, version FROM change_versions
+            WHERE project_id = ? AND table_name IN ({placeholders})
+        ''', (project_id, *tables)).fetchall()
+    versions = dict(rows)
+    return [versions.get(table, 0) for table in tables]
+
+
+async def change_etag(db, project_id, tables, ndjson=False):
+    """
+    Weak ETag for a project's view of tables, built from change_versions.
+
+    The versions are bumped by triggers on every write, so the ETag changes
+    exactly when one of the tables changes for that project. The NDJSON
+    representation gets its own ETag, since it can share a URL with the
+    JSON one and be selected by the Accept header alone.
+    """
+    versions = await db.run(_change_versions, project_id, tables)
+    scope = "all" if project_id is None else project_id
+    suffix = "-ndjson" if ndjson else ""
+    return f'W/"{scope}-{".".join(str(version) for version in versions)}{suffix}"'
+
+
+def set_etag(response, etag):
+    response.headers["ETag"] = etag
+    # The representation, and so the ETag, depends on the Accept header
+    response.headers["Vary"] = "Accept"
+    return response
+
+
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag):
+    return set_etag(Response(status_code=304), etag)
@@ -0,0 +1,51 @@
+import base64
+import binascii
+from typing import Optional
+
+from fastapi import HTTPException, Query, Response
+
+# Largest page a client can ask for with ?limit=
+MAX_PAGE_SIZE = 10000
+
+# Response header carrying the cursor of the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, _, value = base64.urlsafe_b64decode(padded).decode().partition(":")
+        if prefix != "id":
+            raise ValueError(cursor)
+        return int(value)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class Page:
+    """
+    Keyset pagination parameters for the list endpoints.
+
+    Without a limit the endpoints keep returning the whole collection. With a
+    limit they return at most that many items ordered by id, and set the
+    X-Next-Cursor header when another page may follow; passing its value back
+    as ?cursor= resumes after the last id of the previous page.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of items to return"),
+        cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+    ):
+        self.limit = limit
+        self.after = decode_cursor(cursor) if cursor else None
+
+    def set_next_cursor(self, response: Response, items):
+        """Advertise the next page on response when this page is full."""
+        if self.limit is None or len(items) < self.limit:
+            return
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(items[-1]['id'])
@@ -0,0 +1,40 @@
+import json
+
+from fastapi.responses import Response
+
+# orjson is optional; it is several times faster than the standard library
+# encoder on the large nested lists these routes return.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content):
+    """Serialize already-shaped rows (dicts, lists and scalars) to JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    """Parse JSON from bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response for rows the route has already shaped to match its
+    response_model.
+
+    Returning it from a route skips FastAPI's per-item validation and
+    re-serialization through the pydantic models, which on big payloads costs
+    more than the SQL. The models stay on the routes for the OpenAPI docs.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
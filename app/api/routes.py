@@ -1,5 +1,5 @@
 from typing import Optional, List
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 import sqlite3
 from typing import List
 from app.schemas.schemas import (
@@ -7,6 +7,24 @@ from app.schemas.schemas import (
 )
 from fastapi.responses import RedirectResponse
 
+from app.api.cache import ResponseCache, response_cache
+from app.api.coalesce import single_flight
+from app.api.etag import (
+    PATIENTS_METADATA_TABLES,
+    PATIENTS_TABLES,
+    SAMPLES_TABLES,
+    change_etag,
+    etag_matches,
+    not_modified,
+    set_etag,
+)
+from app.api.pagination import Page
+from app.api.responses import FastJSONResponse
+from app.api.streaming import ndjson_records, ndjson_response, wants_ndjson
+from app.db.database import METADATA_TABLES
+from app.db.ingest import delete_raw_files, upsert_metadata, upsert_raw_files
+from app.db.pool import ConnectionPool, get_db
+
 from app.schemas.schemas import (
     Project,
     Dataset,
@@ -23,76 +41,149 @@ from app.schemas.schemas import (
     PatientWithSamples,
     RawFileMetadataCreate,
     RawFileCreate,
+    RawFileRemove,
     MetadataUpdate,
+    MetadataUpsert,
 )
 
-DATABASE = 'data/data_redmane.db'
-
 router = APIRouter()
 
-@router.post("/add_raw_files/")
-async def add_raw_files(raw_files: List[RawFileCreate]):
+# Range of a SQLite INTEGER
+MIN_SQLITE_INTEGER = -2 ** 63
+MAX_SQLITE_INTEGER = 2 ** 63 - 1
+
+def _raw_file_row(raw_file):
+    # A 'sample_id' metadata entry is stored in the indexed
+    # raw_files.sample_id column rather than as a metadata row
+    sample_id = raw_file.sample_id
+    metadata = []
+    for entry in raw_file.metadata or []:
+        if entry.metadata_key == 'sample_id' and sample_id is None:
+            # isdigit() alone accepts characters such as '²' that int() rejects
+            if not (entry.metadata_value.isascii() and entry.metadata_value.isdecimal()):
+                raise HTTPException(status_code=422, detail=f"Invalid sample_id for {raw_file.path}")
+            sample_id = int(entry.metadata_value)
+        elif entry.metadata_key != 'sample_id':
+            metadata.append((entry.metadata_key, entry.metadata_value))
+    if sample_id is not None and not MIN_SQLITE_INTEGER <= sample_id <= MAX_SQLITE_INTEGER:
+        raise HTTPException(status_code=422, detail=f"Invalid sample_id for {raw_file.path}")
+    return raw_file.dataset_id, raw_file.path, sample_id, metadata
+
+def _upsert_raw_file_rows(conn, rows, counts=None):
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        counts = upsert_raw_files(conn, rows, counts)
+        conn.commit()
+        return counts
 
-        # Insert raw_files and fetch their IDs
-        raw_file_ids = []
-        for raw_file in raw_files:
-            cursor.execute('''
-                INSERT INTO raw_files (dataset_id, path)
-                VALUES (?, ?)
-            ''', (raw_file.dataset_id, raw_file.path))
-            raw_file_id = cursor.lastrowid
-            raw_file_ids.append(raw_file_id)
-
-            # Insert associated metadata for this raw_file
-            if raw_file.metadata:
-                for metadata in raw_file.metadata:
-                    cursor.execute('''
-                        INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value)
-                        VALUES (?, ?, ?)
-                    ''', (raw_file_id, metadata.metadata_key, metadata.metadata_value))
+    except sqlite3.Error as e:
+        # The connection is reused, so never leave a half-written transaction open
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+def _add_raw_files(conn, raw_files):
+    rows = [_raw_file_row(raw_file) for raw_file in raw_files]
+    counts = _upsert_raw_file_rows(conn, rows)
+    return {"status": "success", "message": "Raw files and metadata added successfully", **counts}
+
+@router.post("/add_raw_files/")
+async def add_raw_files(raw_files: List[RawFileCreate], db: ConnectionPool = Depends(get_db)):
+    result = await db.write(_add_raw_files, raw_files)
+    response_cache.invalidate(*{("dataset", raw_file.dataset_id) for raw_file in raw_files})
+    return result
 
+def _remove_raw_files(conn, keys):
+    try:
+        removed = delete_raw_files(conn, keys)
         conn.commit()
-        conn.close()
-        return {"status": "success", "message": "Raw files and metadata added successfully"}
+        return removed
 
     except sqlite3.Error as e:
+        conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
+# Route to remove raw files that are no longer on disk
+@router.post("/remove_raw_files/")
+async def remove_raw_files(raw_files: List[RawFileRemove], db: ConnectionPool = Depends(get_db)):
+    removed = await db.write(_remove_raw_files, [(raw_file.dataset_id, raw_file.path) for raw_file in raw_files])
+    response_cache.invalidate(*{("dataset", raw_file.dataset_id) for raw_file in raw_files})
+    return {"status": "success", "removed": removed}
+
+# Files committed per transaction by the streaming ingestion endpoint
+INGEST_CHUNK_SIZE = 10000
+
+# Route to add raw files from a streamed NDJSON body, one RawFileCreate per line
+@router.post("/add_raw_files/stream")
+async def add_raw_files_stream(request: Request, db: ConnectionPool = Depends(get_db)):
+    """
+    The body may be gzip-compressed (Content-Encoding: gzip). It is parsed as
+    it arrives and committed every INGEST_CHUNK_SIZE files, so memory stays
+    bounded whatever the manifest size. If a line is invalid the chunks
+    before it stay committed; ingestion is idempotent, so the whole manifest
+    can simply be sent again.
+    """
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    rows = []
+
+    async def commit_chunk():
+        await db.write(_upsert_raw_file_rows, rows, counts)
+        response_cache.invalidate(*{("dataset", row[0]) for row in rows})
+
+    async for line_number, record in ndjson_records(request):
+        if not isinstance(record, dict):
+            raise HTTPException(status_code=422, detail=f"Invalid raw file on line {line_number}: expected an object")
+        try:
+            raw_file = RawFileCreate(**record)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid raw file on line {line_number}: {e}")
+        rows.append(_raw_file_row(raw_file))
+        if len(rows) >= INGEST_CHUNK_SIZE:
+            await commit_chunk()
+            rows = []
+    if rows:
+        await commit_chunk()
+
+    return {"status": "success", "message": "Raw files and metadata added successfully", **counts}
+
+# Counters for the single-flight request coalescing
+@router.get("/metrics/coalescing")
+async def get_coalescing_metrics():
+    return single_flight.stats()
+
+# Counters for the group-committed writes
+@router.get("/metrics/writes")
+async def get_write_metrics(db: ConnectionPool = Depends(get_db)):
+    return db.write_stats()
+
 @router.get("/")
 async def root():
     return RedirectResponse(url="/projects")
 
-# Route to fetch all patients and their metadata for a project_id
-@router.get("/patients_metadata/{patient_id}", response_model=List[PatientWithSamples])
-async def get_patients_metadata(project_id: int,patient_id: int):
+def _get_patients_metadata(conn, project_id, patient_id, after=None, limit=None):
     try:
-        conn = sqlite3.connect(DATABASE)
         cursor = conn.cursor()
 
-
+        # Select the page of patients in a subquery so the limit counts
+        # patients rather than patient/metadata rows
+        patient_query = 'SELECT * FROM patients WHERE project_id = ?'
+        params = [project_id]
         if patient_id != 0:
-
-            cursor.execute('''
-                SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
-                       pm.id, pm.key, pm.value
-                FROM patients p
-                LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
-                WHERE p.project_id = ? and p.id = ?
-                ORDER BY p.id
-            ''', (project_id,patient_id,))
-        else:
-    
-            cursor.execute('''
-                SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
-                       pm.id, pm.key, pm.value
-                FROM patients p
-                LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
-                WHERE p.project_id = ?
-                ORDER BY p.id
-            ''', (project_id,))
+            patient_query += ' AND id = ?'
+            params.append(patient_id)
+        if after is not None:
+            patient_query += ' AND id > ?'
+            params.append(after)
+        patient_query += ' ORDER BY id'
+        if limit is not None:
+            patient_query += ' LIMIT ?'
+            params.append(limit)
+
+        cursor.execute(f'''
+            SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
+                   pm.id, pm.key, pm.value
+            FROM ({patient_query}) p
+            LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
+            ORDER BY p.id
+        ''', params)
 
         rows = cursor.fetchall()
 
@@ -126,81 +217,106 @@ async def get_patients_metadata(project_id: int,patient_id: int):
         if current_patient:
             patients.append(current_patient)
 
-
-        for patient in patients:
-            cursor.execute('''
-                SELECT s.id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
-                       sm.id, sm.key, sm.value
-                FROM samples s
-                LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
-                WHERE s.patient_id = ?
-                ORDER BY s.id
-            ''', (patient['id'],))
-
-            sample_rows = cursor.fetchall()
-            current_sample = None
-            for sample_row in sample_rows:
-                if not current_sample or current_sample['id'] != sample_row[0]:
-                    if current_sample:
-                        patient['samples'].append(current_sample)
-                    current_sample = {
-                        'id': sample_row[0],
-                        'patient_id': sample_row[1],
-                        'ext_sample_id': sample_row[2],
-                        'ext_sample_url': sample_row[3],
-                        'metadata': []
-                    }
-                if sample_row[4]:
-                    current_sample['metadata'].append({
-                        'id': sample_row[4],
-                        'sample_id': sample_row[0],
-                        'key': sample_row[5],
-                        'value': sample_row[6]
-                    })
-            if current_sample:
-                patient['samples'].append(current_sample)
-
-        conn.close()
+        if not patients:
+            return patients
+
+        # Fetch the samples of every selected patient in one query instead of
+        # one query per patient, then attach them in a single pass
+        sample_query = '''
+            SELECT s.id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
+                   sm.id, sm.key, sm.value
+            FROM patients p
+            JOIN samples s ON s.patient_id = p.id
+            LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
+            WHERE p.project_id = ?
+        '''
+        sample_params = [project_id]
+        if patient_id != 0:
+            sample_query += ' AND p.id = ?'
+            sample_params.append(patient_id)
+        if after is not None or limit is not None:
+            # Patients of a page are a contiguous id range of the project
+            sample_query += ' AND p.id BETWEEN ? AND ?'
+            sample_params.extend([patients[0]['id'], patients[-1]['id']])
+        sample_query += ' ORDER BY s.id, sm.id'
+        cursor.execute(sample_query, sample_params)
+
+        patients_by_id = {patient['id']: patient for patient in patients}
+        current_sample = None
+        for sample_row in cursor:
+            if not current_sample or current_sample['id'] != sample_row[0]:
+                current_sample = {
+                    'id': sample_row[0],
+                    'patient_id': sample_row[1],
+                    'ext_sample_id': sample_row[2],
+                    'ext_sample_url': sample_row[3],
+                    'metadata': []
+                }
+                patients_by_id[sample_row[1]]['samples'].append(current_sample)
+            if sample_row[4]:
+                current_sample['metadata'].append({
+                    'id': sample_row[4],
+                    'sample_id': sample_row[0],
+                    'key': sample_row[5],
+                    'value': sample_row[6]
+                })
 
         return patients
 
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-# Route to fetch all samples and metadata for a project_id and include patient information
-@router.get("/samples/{sample_id}", response_model=List[Sample])
-async def get_samples_per_patient(sample_id: int, project_id: int):
+# Route to fetch all patients and their metadata for a project_id
+@router.get("/patients_metadata/{patient_id}", response_model=List[PatientWithSamples])
+async def get_patients_metadata(request: Request, project_id: int,patient_id: int, page: Page = Depends(), ndjson: bool = Depends(wants_ndjson), db: ConnectionPool = Depends(get_db)):
+    etag = await change_etag(db, project_id, PATIENTS_METADATA_TABLES, ndjson)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    if ndjson:
+        response = ndjson_response(db, _get_patients_metadata, project_id, patient_id)
+    else:
+        async def build():
+            patients = await db.run(_get_patients_metadata, project_id, patient_id, page.after, page.limit)
+            response = FastJSONResponse(patients)
+            page.set_next_cursor(response, patients)
+            return response
+
+        response = await single_flight.fetch((ResponseCache.key(request), etag), build)
+    return set_etag(response, etag)
+
+def _get_samples_per_patient(conn, sample_id, project_id, after=None, limit=None):
     try:
-        conn = sqlite3.connect(DATABASE)
         cursor = conn.cursor()
 
+        # Select the page of samples in a subquery so the limit counts
+        # samples rather than sample/metadata rows
+        sample_query = '''
+            SELECT * FROM samples
+            WHERE patient_id IN (SELECT id FROM patients WHERE project_id = ?)
+        '''
+        params = [project_id]
         if sample_id != 0:
-            cursor.execute('''
-                SELECT s.id AS sample_id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
-                       sm.id AS metadata_id, sm.key, sm.value,
-                       p.id AS patient_id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id
-                FROM samples s
-                LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
-                LEFT JOIN patients p ON s.patient_id = p.id
-                WHERE p.project_id = ? and s.id = ?
-                ORDER BY s.id, sm.id
-            ''', (project_id,sample_id,))
-        else:
-            cursor.execute('''
-                SELECT s.id AS sample_id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
-                       sm.id AS metadata_id, sm.key, sm.value,
-                       p.id AS patient_id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id
-                FROM samples s
-                LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
-                LEFT JOIN patients p ON s.patient_id = p.id
-                WHERE p.project_id = ?
-                ORDER BY s.id, sm.id
-            ''', (project_id,))
- 
-
+            sample_query += ' AND id = ?'
+            params.append(sample_id)
+        if after is not None:
+            sample_query += ' AND id > ?'
+            params.append(after)
+        sample_query += ' ORDER BY id'
+        if limit is not None:
+            sample_query += ' LIMIT ?'
+            params.append(limit)
+
+        cursor.execute(f'''
+            SELECT s.id AS sample_id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
+                   sm.id AS metadata_id, sm.key, sm.value,
+                   p.id AS patient_id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id
+            FROM ({sample_query}) s
+            LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
+            LEFT JOIN patients p ON s.patient_id = p.id
+            ORDER BY s.id, sm.id
+        ''', params)
 
         rows = cursor.fetchall()
-        conn.close()
 
         samples = []
         current_sample = None
@@ -239,13 +355,26 @@ async def get_samples_per_patient(sample_id: int, project_id: int):
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-# Route to fetch all patients with sample counts
-@router.get("/patients/", response_model=List[PatientWithSampleCount])
-async def get_patients(
-    project_id: Optional[int] = Query(None, description="Filter by project ID")
-):
+# Route to fetch all samples and metadata for a project_id and include patient information
+@router.get("/samples/{sample_id}", response_model=List[Sample])
+async def get_samples_per_patient(request: Request, sample_id: int, project_id: int, page: Page = Depends(), ndjson: bool = Depends(wants_ndjson), db: ConnectionPool = Depends(get_db)):
+    etag = await change_etag(db, project_id, SAMPLES_TABLES, ndjson)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    if ndjson:
+        response = ndjson_response(db, _get_samples_per_patient, sample_id, project_id)
+    else:
+        async def build():
+            samples = await db.run(_get_samples_per_patient, sample_id, project_id, page.after, page.limit)
+            response = FastJSONResponse(samples)
+            page.set_next_cursor(response, samples)
+            return response
+
+        response = await single_flight.fetch((ResponseCache.key(request), etag), build)
+    return set_etag(response, etag)
+
+def _get_patients(conn, project_id, after=None, limit=None):
     try:
-        conn = sqlite3.connect(DATABASE)
         cursor = conn.cursor()
 
         # Base query to fetch all patients with sample counts
@@ -258,17 +387,24 @@ async def get_patients(
         params = []
 
         # Append conditions based on the presence of project_id
+        query += ' WHERE 1=1'
         if project_id is not None:
-            query += ' WHERE patients.project_id = ?'
+            query += ' AND patients.project_id = ?'
             params.append(project_id)
+
+        if after is not None:
+            query += ' AND patients.id > ?'
+            params.append(after)
         
         # Complete the query
         query += ' GROUP BY patients.id ORDER BY patients.id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
 
         # Execute the query
         cursor.execute(query, params)
         rows = cursor.fetchall()
-        conn.close()
         
         # Process the results
         patients = []
@@ -287,23 +423,45 @@ async def get_patients(
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-# Route to fetch all projects and their statuses
-@router.get("/projects/", response_model=List[Project])
-async def get_projects():
-    conn = sqlite3.connect(DATABASE)
+# Route to fetch all patients with sample counts
+@router.get("/patients/", response_model=List[PatientWithSampleCount])
+async def get_patients(
+    request: Request,
+    project_id: Optional[int] = Query(None, description="Filter by project ID"),
+    page: Page = Depends(),
+    ndjson: bool = Depends(wants_ndjson),
+    db: ConnectionPool = Depends(get_db)
+):
+    etag = await change_etag(db, project_id, PATIENTS_TABLES, ndjson)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    if ndjson:
+        return set_etag(ndjson_response(db, _get_patients, project_id), etag)
+
+    async def build():
+        patients = await db.run(_get_patients, project_id, page.after, page.limit)
+        response = FastJSONResponse(patients)
+        page.set_next_cursor(response, patients)
+        return response
+
+    response = await response_cache.fetch(request, db, [("project", project_id)], build, etag)
+    return set_etag(response, etag)
+
+def _get_projects(conn):
     cursor = conn.cursor()
     cursor.execute("SELECT id, name, status FROM projects")
     rows = cursor.fetchall()
-    conn.close()
-    return [Project(id=row[0], name=row[1], status=row[2]) for row in rows]
+    return [{'id': row[0], 'name': row[1], 'status': row[2]} for row in rows]
 
-# Route to fetch all datasets
-@router.get("/datasets/", response_model=List[Dataset])
-async def get_datasets(
-    project_id: Optional[int] = Query(None, description="Filter by project ID"),
-    dataset_id: Optional[int] = Query(None, description="Filter by dataset ID")
-):
-    conn = sqlite3.connect(DATABASE)
+# Route to fetch all projects and their statuses
+@router.get("/projects/", response_model=List[Project])
+async def get_projects(request: Request, db: ConnectionPool = Depends(get_db)):
+    async def build():
+        return FastJSONResponse(await db.run(_get_projects))
+
+    return await response_cache.fetch(request, db, [("projects",)], build)
+
+def _get_datasets(conn, project_id, dataset_id, after=None, limit=None):
     cursor = conn.cursor()
 
     query = "SELECT id, project_id, name FROM datasets WHERE 1=1"
@@ -317,17 +475,43 @@ async def get_datasets(
         query += " AND id = ?"
         params.append(dataset_id)
 
+    if after is not None:
+        query += " AND id > ?"
+        params.append(after)
+
+    query += " ORDER BY id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
     cursor.execute(query, params)
     rows = cursor.fetchall()
-    conn.close()
     
-    return [Dataset(id=row[0], project_id=row[1], name=row[2]) for row in rows]
+    return [{'id': row[0], 'project_id': row[1], 'name': row[2]} for row in rows]
 
-# Endpoint to fetch dataset details and metadata by dataset_id
-@router.get("/datasets_with_metadata/{dataset_id}", response_model=DatasetWithMetadata)
-async def get_dataset_with_metadata(dataset_id: int, project_id: int):
+# Route to fetch all datasets
+@router.get("/datasets/", response_model=List[Dataset])
+async def get_datasets(
+    request: Request,
+    project_id: Optional[int] = Query(None, description="Filter by project ID"),
+    dataset_id: Optional[int] = Query(None, description="Filter by dataset ID"),
+    page: Page = Depends(),
+    ndjson: bool = Depends(wants_ndjson),
+    db: ConnectionPool = Depends(get_db)
+):
+    if ndjson:
+        return ndjson_response(db, _get_datasets, project_id, dataset_id)
+
+    async def build():
+        datasets = await db.run(_get_datasets, project_id, dataset_id, page.after, page.limit)
+        response = FastJSONResponse(datasets)
+        page.set_next_cursor(response, datasets)
+        return response
+
+    return await response_cache.fetch(request, db, [("project", project_id)], build)
+
+def _get_dataset_with_metadata(conn, dataset_id, project_id):
     try:
-        conn = sqlite3.connect(DATABASE)
         cursor = conn.cursor()
         
         # Fetch dataset details
@@ -349,7 +533,6 @@ async def get_dataset_with_metadata(dataset_id: int, project_id: int):
         ''', (dataset_id,))
         metadata_rows = cursor.fetchall()
         
-        conn.close()
         
         dataset = {
             "id": dataset_row[0],
@@ -363,102 +546,126 @@ async def get_dataset_with_metadata(dataset_id: int, project_id: int):
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-@router.get("/raw_files_with_metadata/{dataset_id}", response_model=List[RawFileResponse])
-async def get_raw_files_with_metadata(dataset_id: int):
-    conn = sqlite3.connect(DATABASE)
+# Endpoint to fetch dataset details and metadata by dataset_id
+@router.get("/datasets_with_metadata/{dataset_id}", response_model=DatasetWithMetadata)
+async def get_dataset_with_metadata(request: Request, dataset_id: int, project_id: int, db: ConnectionPool = Depends(get_db)):
+    async def build():
+        return FastJSONResponse(await db.run(_get_dataset_with_metadata, dataset_id, project_id))
+
+    return await response_cache.fetch(request, db, [("project", project_id), ("dataset", dataset_id)], build)
+
+def _get_raw_files_with_metadata(conn, dataset_id, after=None, limit=None):
     cursor = conn.cursor()
     
-    # Query to get raw files and their associated metadata
+    # Query to get raw files and the samples they are linked to
     query = """
-    SELECT rf.id, rf.path, rfm.metadata_value AS sample_id, s.ext_sample_id
+    SELECT rf.id, rf.path, rf.sample_id, s.ext_sample_id
     FROM raw_files rf
-    LEFT JOIN raw_files_metadata rfm ON rf.id = rfm.raw_file_id
-    LEFT JOIN samples s ON rfm.metadata_value = s.id
-    WHERE rf.dataset_id = ? AND rfm.metadata_key = 'sample_id'
+    LEFT JOIN samples s ON rf.sample_id = s.id
+    WHERE rf.dataset_id = ? AND rf.sample_id IS NOT NULL
     """
-    cursor.execute(query, (dataset_id,))
+    params = [dataset_id]
+    if after is not None:
+        query += " AND rf.id > ?"
+        params.append(after)
+    query += " ORDER BY rf.id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    cursor.execute(query, params)
     raw_files = cursor.fetchall()
+    if not raw_files:
+        return []
+
+    # Fetch the metadata of every sample linked to this dataset in one query,
+    # grouped by sample so files that share a sample reuse the same list
+    # (restricted to the id range of the current page)
+    cursor.execute("""
+    SELECT sm.id, sm.sample_id, sm.key, sm.value
+    FROM samples_metadata sm
+    WHERE sm.sample_id IN (
+        SELECT DISTINCT rf.sample_id
+        FROM raw_files rf
+        WHERE rf.dataset_id = ? AND rf.id BETWEEN ? AND ?
+    )
+    ORDER BY sm.sample_id, sm.id
+    """, (dataset_id, raw_files[0][0], raw_files[-1][0]))
+
+    sample_metadata = {}
+    for row in cursor:
+        sample_metadata.setdefault(row[1], []).append({
+            'id': row[0],
+            'sample_id': row[1],
+            'key': row[2],
+            'value': row[3]
+        })
 
     response = []
     
     for raw_file in raw_files:
         raw_file_id, path, sample_id, ext_sample_id = raw_file
-        
-        # Fetch sample metadata
-        cursor.execute("SELECT id, sample_id, key, value FROM samples_metadata WHERE sample_id = ?", (sample_id,))
-        sample_metadata_rows = cursor.fetchall()
 
-        sample_metadata_list = []
-        for row in sample_metadata_rows:
-            sample_metadata_list.append({
-                'id': row[0],
-                'sample_id': row[1],
-                'key': row[2],
-                'value': row[3]
-                
+        response.append({
+            'id': raw_file_id,
+            'path': path,
+            'sample_id': str(sample_id),
+            'ext_sample_id': ext_sample_id,
+            'sample_metadata': sample_metadata.get(sample_id, [])
+        })
 
-            }) 
-        print(sample_metadata_list)
+    return response
 
+@router.get("/raw_files_with_metadata/{dataset_id}", response_model=List[RawFileResponse])
+async def get_raw_files_with_metadata(request: Request, dataset_id: int, page: Page = Depends(), ndjson: bool = Depends(wants_ndjson), db: ConnectionPool = Depends(get_db)):
+    if ndjson:
+        return ndjson_response(db, _get_raw_files_with_metadata, dataset_id)
 
-        response.append(RawFileResponse(
-            id=raw_file_id,
-            path=path,
-            sample_id=sample_id,
-            ext_sample_id=ext_sample_id,
-            sample_metadata=sample_metadata_list
-        ))
+    async def build():
+        raw_files = await db.run(_get_raw_files_with_metadata, dataset_id, page.after, page.limit)
+        response = FastJSONResponse(raw_files)
+        page.set_next_cursor(response, raw_files)
+        return response
 
-    conn.close()
-    return response
+    return await single_flight.fetch(ResponseCache.key(request), build)
 
-@router.put("/datasets_metadata/size_update", response_model=MetadataUpdate)
-def update_metadata(update: MetadataUpdate):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # Update record with key 'raw_file_extension_size_of_all_files' for the given dataset_id
+def _upsert_metadata(conn, entity, rows):
+    try:
+        counts = upsert_metadata(conn, entity, rows)
+        conn.commit()
+        return counts
+
+    except sqlite3.Error as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+def _update_metadata(conn, update):
+    rows = []
     if update.raw_file_size:
-        cursor.execute(
-            "SELECT id, value FROM datasets_metadata WHERE key = 'raw_file_extension_size_of_all_files' AND dataset_id = ?",
-            (update.dataset_id,)
-        )
-        record = cursor.fetchone()
-        if record:
-            record_id, value_str = record
-            # Update the metadata with the new value
-            cursor.execute(
-                "UPDATE datasets_metadata SET value = ? WHERE id = ?",
-                (update.raw_file_size, record_id)
-            )
-        else:
-            # Insert a new record if it doesn't exist
-            cursor.execute(
-                "INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, 'raw_file_extension_size_of_all_files', ?)",
-                (update.dataset_id, update.raw_file_size))
-            
-    
-    # Update record with key 'last_size_update' for the given dataset_id
+        rows.append((update.dataset_id, 'raw_file_extension_size_of_all_files', update.raw_file_size))
     if update.last_size_update:
-        cursor.execute(
-            "SELECT id, value FROM datasets_metadata WHERE key = 'last_size_update' AND dataset_id = ?",
-            (update.dataset_id,)
-        )
-        record = cursor.fetchone()
-        if record:
-            record_id, value_str = record
-            # Update the metadata with the new value
-            cursor.execute(
-                "UPDATE datasets_metadata SET value = ? WHERE id = ?",
-                (update.last_size_update, record_id)
-            )
-        else:
-            # Insert a new record if it doesn't exist
-            cursor.execute(
-                "INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, 'last_size_update', ?)",
-                (update.dataset_id, update.last_size_update))
-    
-    conn.commit()
-    conn.close()
-
+        rows.append((update.dataset_id, 'last_size_update', update.last_size_update))
+    _upsert_metadata(conn, 'datasets', rows)
     return update
+
+@router.put("/datasets_metadata/size_update", response_model=MetadataUpdate)
+async def update_metadata(update: MetadataUpdate, db: ConnectionPool = Depends(get_db)):
+    result = await db.write(_update_metadata, update)
+    response_cache.invalidate(("dataset", update.dataset_id))
+    return result
+
+# Route to insert or update arbitrary metadata of datasets, patients, samples or raw_files
+@router.put("/metadata/{entity}")
+async def upsert_entity_metadata(entity: str, metadata: List[MetadataUpsert], db: ConnectionPool = Depends(get_db)):
+    if entity not in METADATA_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown metadata entity: {entity}")
+    if entity == 'raw_files' and any(item.key == 'sample_id' for item in metadata):
+        # The link lives in raw_files.sample_id, which add_raw_files maintains
+        raise HTTPException(status_code=422, detail="Set raw file sample_id through /add_raw_files/")
+    rows = [(item.entity_id, item.key, item.value) for item in metadata]
+    counts = await db.write(_upsert_metadata, entity, rows)
+    if entity == 'datasets':
+        response_cache.invalidate(*{("dataset", item.entity_id) for item in metadata})
+    else:
+        # No cached route shows this metadata; only detach in-flight reads
+        response_cache.invalidate()
+    return {"status": "success", **counts}
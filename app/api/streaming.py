@@ -0,0 +1,105 @@
+import zlib
+
+from fastapi import HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from app.api.responses import dumps, loads
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Number of items fetched from the database per keyset page while streaming
+STREAM_PAGE_SIZE = 1000
+
+# Longest NDJSON line accepted in a request body
+MAX_LINE_BYTES = 1024 * 1024
+
+# Largest piece a gzip body is inflated into at a time
+INFLATE_CHUNK_BYTES = 256 * 1024
+
+
+def wants_ndjson(
+    request: Request,
+    stream: bool = Query(False, description="Stream the collection as NDJSON"),
+):
+    """FastAPI dependency: True when the client asked for an NDJSON stream."""
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(db, fn, *args):
+    """
+    Stream a collection as one JSON object per line.
+
+    fn is a route helper taking (conn, *args, after, limit); it is called one
+    keyset page at a time, so only a single page is held in memory and the
+    first rows are sent as soon as the first page is read.
+    """
+    async def lines():
+        after = None
+        while True:
+            page = await db.run(fn, *args, after, STREAM_PAGE_SIZE)
+            if page:
+                yield b"".join(dumps(item) + b"\n" for item in page)
+            if len(page) < STREAM_PAGE_SIZE:
+                break
+            after = page[-1]['id']
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+
+async def _body_pieces(request, encoding):
+    if encoding == "identity":
+        async for chunk in request.stream():
+            yield chunk
+        return
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        async for data in request.stream():
+            # Inflate in bounded steps, so a small compressed chunk cannot
+            # expand into a huge buffer at once
+            while data:
+                if decompressor.eof:
+                    # Concatenated gzip members, as produced by appending to a .gz file
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                piece = decompressor.decompress(data, INFLATE_CHUNK_BYTES)
+                data = decompressor.unused_data if decompressor.eof else decompressor.unconsumed_tail
+                yield piece
+    except zlib.error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid gzip body: {e}")
+    if not decompressor.eof:
+        raise HTTPException(status_code=400, detail="Truncated gzip body")
+
+
+async def ndjson_records(request: Request):
+    """
+    Parse an NDJSON request body as it arrives, yielding (line_number, record).
+
+    The body may be gzip-compressed with Content-Encoding: gzip. Only the
+    current line is buffered, so memory stays bounded however long the body
+    is; blank lines are skipped.
+    """
+    encoding = request.headers.get("content-encoding", "identity").lower()
+    if encoding not in ("identity", "gzip"):
+        raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+
+    pending = b""
+    line_number = 0
+    async for piece in _body_pieces(request, encoding):
+        pending += piece
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, _parse_line(line, line_number)
+        if len(pending) > MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail=f"Line {line_number + 1} is longer than {MAX_LINE_BYTES} bytes")
+
+    if pending.strip():
+        yield line_number + 1, _parse_line(pending, line_number + 1)
+
+
+def _parse_line(line, line_number):
+    try:
+        return loads(line)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid JSON on line {line_number}: {e}")
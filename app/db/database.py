@@ -1,10 +1,36 @@
+import os
 import sqlite3
 
-DATABASE = 'data/data_redmane.db'
+# REDMANE_DATABASE points the app at another database file, e.g. a scratch
+# copy for the tests
+DATABASE = os.environ.get('REDMANE_DATABASE', 'data/data_redmane.db')
+
+# Pragma profile applied once to every connection when it is opened.
+# WAL lets the dashboards keep reading while add_raw_files is writing.
+# Each value can be overridden with a REDMANE_SQLITE_<NAME> environment
+# variable, e.g. REDMANE_SQLITE_MMAP_SIZE=0 to turn memory mapping off.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,           # milliseconds
+    'cache_size': -65536,           # negative means KiB, i.e. 64 MiB
+    'mmap_size': 268435456,         # 256 MiB
+    'temp_store': 'MEMORY',
+}
+
+PRAGMAS = {
+    name: os.environ.get(f'REDMANE_SQLITE_{name.upper()}', value)
+    for name, value in DEFAULT_PRAGMAS.items()
+}
+
+def apply_pragmas(conn, pragmas=PRAGMAS):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
 
 def init_db():
     try:
         conn = sqlite3.connect(DATABASE)
+        apply_pragmas(conn)
         cur = conn.cursor()
 
         # Create tables
@@ -81,7 +107,9 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             dataset_id INTEGER NOT NULL,
             path TEXT,
-            FOREIGN KEY (dataset_id) REFERENCES datasets(id)
+            sample_id INTEGER,
+            FOREIGN KEY (dataset_id) REFERENCES datasets(id),
+            FOREIGN KEY (sample_id) REFERENCES samples(id)
         );
         ''')
 
@@ -95,9 +123,187 @@ def init_db():
         );
         ''')
 
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS change_versions (
+            project_id INTEGER NOT NULL,
+            table_name TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (project_id, table_name)
+        ) WITHOUT ROWID;
+        ''')
+
+        migrate_raw_files_sample_id(cur)
+        migrate_raw_files_unique(cur)
+        migrate_metadata_unique(cur)
+        create_indexes(cur)
+        create_change_triggers(cur)
+
         conn.commit()
 
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
         conn.close()
+
+# Secondary indexes. The metadata (EAV) tables get composite
+# (entity_id, key, value) indexes so that key lookups for one entity are
+# covered by the index and never scan the table.
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_datasets_project_id ON datasets (project_id)',
+    'CREATE INDEX IF NOT EXISTS idx_patients_project_id ON patients (project_id)',
+    'CREATE INDEX IF NOT EXISTS idx_samples_patient_id ON samples (patient_id)',
+    'CREATE INDEX IF NOT EXISTS idx_raw_files_dataset_id ON raw_files (dataset_id, sample_id)',
+    'CREATE INDEX IF NOT EXISTS idx_datasets_metadata_dataset_key ON datasets_metadata (dataset_id, key, value)',
+    'CREATE INDEX IF NOT EXISTS idx_patients_metadata_patient_key ON patients_metadata (patient_id, key, value)',
+    'CREATE INDEX IF NOT EXISTS idx_samples_metadata_sample_key ON samples_metadata (sample_id, key, value)',
+    'CREATE INDEX IF NOT EXISTS idx_raw_files_metadata_file_key ON raw_files_metadata (raw_file_id, metadata_key, metadata_value)',
+    # For the ETag of all projects; version is left out so bumps never touch it
+    'CREATE INDEX IF NOT EXISTS idx_change_versions_table_name ON change_versions (table_name)',
+]
+
+def create_indexes(cur):
+    for statement in INDEXES:
+        cur.execute(statement)
+    # Refresh planner statistics so the new indexes are picked up
+    cur.execute('PRAGMA optimize')
+
+# Metadata (EAV) tables by entity: (table, row id, entity id, key, value) columns
+METADATA_TABLES = {
+    'datasets': ('datasets_metadata', 'id', 'dataset_id', 'key', 'value'),
+    'patients': ('patients_metadata', 'id', 'patient_id', 'key', 'value'),
+    'samples': ('samples_metadata', 'id', 'sample_id', 'key', 'value'),
+    'raw_files': ('raw_files_metadata', 'metadata_id', 'raw_file_id', 'metadata_key', 'metadata_value'),
+}
+
+# How to find the project of a row in each table; {row} is NEW or OLD
+CHANGE_TRACKED_TABLES = {
+    'projects': '{row}.id',
+    'datasets': '{row}.project_id',
+    'datasets_metadata': '(SELECT project_id FROM datasets WHERE id = {row}.dataset_id)',
+    'raw_files': '(SELECT project_id FROM datasets WHERE id = {row}.dataset_id)',
+    'raw_files_metadata': '''(SELECT d.project_id FROM raw_files rf JOIN datasets d ON d.id = rf.dataset_id
+                              WHERE rf.id = {row}.raw_file_id)''',
+    'patients': '{row}.project_id',
+    'patients_metadata': '(SELECT project_id FROM patients WHERE id = {row}.patient_id)',
+    'samples': '(SELECT project_id FROM patients WHERE id = {row}.patient_id)',
+    'samples_metadata': '''(SELECT p.project_id FROM samples s JOIN patients p ON p.id = s.patient_id
+                            WHERE s.id = {row}.sample_id)''',
+}
+
+def create_change_triggers(cur):
+    """
+    Keep change_versions up to date with triggers.
+
+    Every insert, update or delete bumps the version of (project, table), so
+    writes from the API and from the import scripts are both counted. Rows
+    whose project cannot be resolved any more are counted under project 0.
+    """
+    bump = '''
+        INSERT INTO change_versions (project_id, table_name, version)
+        VALUES (COALESCE({project}, 0), '{table}', 1)
+        ON CONFLICT (project_id, table_name) DO UPDATE SET version = version + 1;
+    '''
+    for table, project in CHANGE_TRACKED_TABLES.items():
+        for event, rows in (('INSERT', ['NEW']), ('UPDATE', ['OLD', 'NEW']), ('DELETE', ['OLD'])):
+            body = ''.join(bump.format(project=project.format(row=row), table=table) for row in rows)
+            cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+            AFTER {event} ON {table}
+            BEGIN
+                {body}
+            END;
+            ''')
+
+def migrate_raw_files_sample_id(cur):
+    """
+    Give raw_files a first-class, indexed sample_id column.
+
+    Databases created before the column existed only link files to samples
+    through raw_files_metadata rows with metadata_key 'sample_id'. The column
+    is added if missing and backfilled from those rows. Only values made of
+    digits are used: any string used to be accepted, and SQLite would cast
+    one like 'abc' to sample 0. The rows are then deleted, since nothing
+    keeps them in step with the column.
+    """
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(raw_files)")]
+    if 'sample_id' not in columns:
+        cur.execute('ALTER TABLE raw_files ADD COLUMN sample_id INTEGER REFERENCES samples(id)')
+
+    numeric_link = '''
+        rfm.raw_file_id = raw_files.id AND rfm.metadata_key = 'sample_id'
+        AND rfm.metadata_value <> '' AND rfm.metadata_value NOT GLOB '*[^0-9]*'
+    '''
+    cur.execute(f'''
+    UPDATE raw_files
+    SET sample_id = (
+        SELECT CAST(rfm.metadata_value AS INTEGER)
+        FROM raw_files_metadata rfm
+        WHERE {numeric_link}
+        ORDER BY rfm.metadata_id
+        LIMIT 1
+    )
+    WHERE sample_id IS NULL AND EXISTS (
+        SELECT 1 FROM raw_files_metadata rfm
+        WHERE {numeric_link}
+    )
+    ''')
+    cur.execute("DELETE FROM raw_files_metadata WHERE metadata_key = 'sample_id'")
+
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_raw_files_sample_id ON raw_files (sample_id)')
+
+def migrate_raw_files_unique(cur):
+    """
+    Make raw files unique on (dataset_id, path) and their metadata unique on
+    (raw_file_id, metadata_key), which the bulk upserts rely on.
+
+    Re-running the tracker used to insert every file again. Before the unique
+    indexes are created, duplicate files are merged into the oldest row and
+    only the newest value of each metadata key is kept.
+    """
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'uq_raw_files_dataset_path'")
+    if cur.fetchone() is None:
+        cur.execute('''
+        UPDATE raw_files_metadata
+        SET raw_file_id = (
+            SELECT MIN(keep.id) FROM raw_files keep
+            JOIN raw_files dup ON dup.dataset_id = keep.dataset_id AND dup.path IS keep.path
+            WHERE dup.id = raw_files_metadata.raw_file_id
+        )
+        WHERE raw_file_id IN (SELECT id FROM raw_files)
+          AND raw_file_id NOT IN (SELECT MIN(id) FROM raw_files GROUP BY dataset_id, path)
+        ''')
+        cur.execute('''
+        DELETE FROM raw_files
+        WHERE id NOT IN (SELECT MIN(id) FROM raw_files GROUP BY dataset_id, path)
+        ''')
+        cur.execute('''
+        DELETE FROM raw_files_metadata
+        WHERE metadata_id NOT IN (
+            SELECT MAX(metadata_id) FROM raw_files_metadata GROUP BY raw_file_id, metadata_key
+        )
+        ''')
+
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS uq_raw_files_dataset_path ON raw_files (dataset_id, path)')
+    cur.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_raw_files_metadata_file_key
+    ON raw_files_metadata (raw_file_id, metadata_key)
+    ''')
+
+def migrate_metadata_unique(cur):
+    """
+    Make each metadata key unique per dataset, patient and sample, so that
+    metadata can be written with INSERT ... ON CONFLICT DO UPDATE.
+
+    Where a key was stored more than once, the newest row is kept.
+    raw_files_metadata is handled by migrate_raw_files_unique.
+    """
+    for entity in ('datasets', 'patients', 'samples'):
+        table, row_id, entity_id, key, _ = METADATA_TABLES[entity]
+        index = f'uq_{table}_{entity_id}_{key}'
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = ?", (index,))
+        if cur.fetchone() is None:
+            cur.execute(f'''
+            DELETE FROM {table}
+            WHERE {row_id} NOT IN (SELECT MAX({row_id}) FROM {table} GROUP BY {entity_id}, {key})
+            ''')
+        cur.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} ({entity_id}, {key})')
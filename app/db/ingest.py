@@ -0,0 +1,169 @@
+# Bulk, idempotent writes of raw files and metadata. Files are identified by
+# (dataset_id, path) and metadata by (entity id, key), both enforced by unique
+# indexes, so posting the same tracker scan twice changes nothing the second
+# time.
+
+from app.db.database import METADATA_TABLES
+
+# Files staged and merged per round of set-based statements
+BATCH_SIZE = 50000
+
+_TEMP_TABLES = [
+    '''
+    CREATE TEMP TABLE IF NOT EXISTS ingest_raw_files (
+        dataset_id INTEGER NOT NULL,
+        path TEXT NOT NULL,
+        sample_id INTEGER,
+        PRIMARY KEY (dataset_id, path)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TEMP TABLE IF NOT EXISTS ingest_raw_files_metadata (
+        dataset_id INTEGER NOT NULL,
+        path TEXT NOT NULL,
+        metadata_key TEXT NOT NULL,
+        metadata_value TEXT NOT NULL,
+        PRIMARY KEY (dataset_id, path, metadata_key)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# The same file or key twice in one request: the later one wins
+_STAGE_FILE = '''
+    INSERT INTO temp.ingest_raw_files (dataset_id, path, sample_id)
+    VALUES (?, ?, ?)
+    ON CONFLICT (dataset_id, path) DO UPDATE
+    SET sample_id = COALESCE(excluded.sample_id, sample_id)
+'''
+
+_STAGE_METADATA = '''
+    INSERT INTO temp.ingest_raw_files_metadata (dataset_id, path, metadata_key, metadata_value)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (dataset_id, path, metadata_key) DO UPDATE
+    SET metadata_value = excluded.metadata_value
+'''
+
+_COUNT_CHANGES = '''
+    SELECT
+        COUNT(*),
+        TOTAL(rf.id IS NULL),
+        TOTAL(rf.id IS NOT NULL AND (
+            (i.sample_id IS NOT NULL AND i.sample_id IS NOT rf.sample_id)
+            OR EXISTS (
+                SELECT 1 FROM temp.ingest_raw_files_metadata im
+                WHERE im.dataset_id = i.dataset_id AND im.path = i.path
+                  AND im.metadata_value IS NOT (
+                      SELECT m.metadata_value FROM raw_files_metadata m
+                      WHERE m.raw_file_id = rf.id AND m.metadata_key = im.metadata_key
+                  )
+            )
+        ))
+    FROM temp.ingest_raw_files i
+    LEFT JOIN raw_files rf ON rf.dataset_id = i.dataset_id AND rf.path = i.path
+'''
+
+# A NULL sample_id leaves an existing link alone. The DO UPDATE ... WHERE
+# clauses skip rows that would not change, so unchanged files cost no write
+# and do not bump change_versions.
+_MERGE_FILES = '''
+    INSERT INTO raw_files (dataset_id, path, sample_id)
+    SELECT dataset_id, path, sample_id FROM temp.ingest_raw_files WHERE true
+    ON CONFLICT (dataset_id, path) DO UPDATE
+    SET sample_id = excluded.sample_id
+    WHERE excluded.sample_id IS NOT NULL AND raw_files.sample_id IS NOT excluded.sample_id
+'''
+
+_MERGE_METADATA = '''
+    INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value)
+    SELECT rf.id, im.metadata_key, im.metadata_value
+    FROM temp.ingest_raw_files_metadata im
+    CROSS JOIN raw_files rf ON rf.dataset_id = im.dataset_id AND rf.path = im.path
+    WHERE true
+    ON CONFLICT (raw_file_id, metadata_key) DO UPDATE
+    SET metadata_value = excluded.metadata_value
+    WHERE raw_files_metadata.metadata_value IS NOT excluded.metadata_value
+'''
+
+
+def upsert_raw_files(conn, raw_files, counts=None):
+    """
+    Insert or update raw files and their metadata without committing.
+
+    raw_files is an iterable of (dataset_id, path, sample_id, metadata)
+    tuples, metadata being a list of (key, value) pairs. Rows are staged in
+    temporary tables with executemany and merged with a few set-based
+    upserts per batch; metadata keys that are not sent are kept.
+
+    Returns counts of inserted, updated and unchanged files, added to counts
+    when it is given.
+    """
+    if counts is None:
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    cursor = conn.cursor()
+    for statement in _TEMP_TABLES:
+        cursor.execute(statement)
+
+    files = []
+    metadata_rows = []
+    for dataset_id, path, sample_id, metadata in raw_files:
+        files.append((dataset_id, path, sample_id))
+        metadata_rows.extend((dataset_id, path, key, value) for key, value in metadata)
+        if len(files) >= BATCH_SIZE:
+            _merge_batch(cursor, files, metadata_rows, counts)
+            files = []
+            metadata_rows = []
+    if files:
+        _merge_batch(cursor, files, metadata_rows, counts)
+    return counts
+
+
+def _merge_batch(cursor, files, metadata_rows, counts):
+    cursor.execute('DELETE FROM temp.ingest_raw_files')
+    cursor.execute('DELETE FROM temp.ingest_raw_files_metadata')
+    cursor.executemany(_STAGE_FILE, files)
+    cursor.executemany(_STAGE_METADATA, metadata_rows)
+
+    total, inserted, updated = cursor.execute(_COUNT_CHANGES).fetchone()
+    counts['inserted'] += int(inserted)
+    counts['updated'] += int(updated)
+    counts['unchanged'] += total - int(inserted) - int(updated)
+
+    cursor.execute(_MERGE_FILES)
+    cursor.execute(_MERGE_METADATA)
+
+
+def delete_raw_files(conn, keys):
+    """
+    Delete raw files and their metadata by (dataset_id, path) without
+    committing. Returns the number of files deleted.
+    """
+    keys = list(keys)
+    cursor = conn.cursor()
+    cursor.executemany('''
+        DELETE FROM raw_files_metadata
+        WHERE raw_file_id = (SELECT id FROM raw_files WHERE dataset_id = ? AND path = ?)
+    ''', keys)
+    cursor.executemany('DELETE FROM raw_files WHERE dataset_id = ? AND path = ?', keys)
+    return max(cursor.rowcount, 0)
+
+
+def upsert_metadata(conn, entity, rows):
+    """
+    Insert or update metadata of one entity type without committing.
+
+    entity is a key of METADATA_TABLES and rows an iterable of
+    (entity_id, key, value). Values that are already stored are not
+    rewritten. Returns counts of written and unchanged rows.
+    """
+    table, _, entity_id, key, value = METADATA_TABLES[entity]
+    rows = list(rows)
+    cursor = conn.cursor()
+    cursor.executemany(f'''
+        INSERT INTO {table} ({entity_id}, {key}, {value})
+        VALUES (?, ?, ?)
+        ON CONFLICT ({entity_id}, {key}) DO UPDATE
+        SET {value} = excluded.{value}
+        WHERE {table}.{value} IS NOT excluded.{value}
+    ''', rows)
+    written = max(cursor.rowcount, 0)
+    return {'written': written, 'unchanged': len(rows) - written}
@@ -0,0 +1,249 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from app.db.database import DATABASE, apply_pragmas
+
+
+class ConnectionPool:
+    """
+    Hands out one long-lived SQLite connection per thread.
+
+    Connections are opened lazily the first time a thread asks for one, have
+    the pragma profile applied once, and are then reused for every request
+    served by that thread, so the page cache survives between requests.
+    Queries are executed through run(), which keeps them on a bounded set of
+    worker threads instead of the event loop.
+
+    Writes go through write() instead, which queues them for a single writer
+    thread that owns the only writable connection (see _writer_loop); the
+    per-thread reader connections are opened with query_only so they can
+    never write by accident.
+
+    The writer thread also publishes the PRAGMA data_version of its
+    connection after every group commit and every poll_interval seconds
+    while idle, so data_version() can be read without waiting for it.
+    """
+
+    def __init__(self, database=DATABASE, max_workers=8, max_group_size=64, poll_interval=0.5):
+        self.database = database
+        self.max_workers = max_workers
+        self.max_group_size = max_group_size
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._writes = queue.Queue()
+        self._writer_thread = None
+        self._writer_lock = threading.Lock()
+        self.group_commits = 0
+        self.grouped_writes = 0
+        self._data_version = None
+        # Bounded set of threads that run queries off the event loop
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db")
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Each connection is only used by its own thread; the check is
+            # disabled so close_all() can close them all at shutdown.
+            conn = sqlite3.connect(self.database, check_same_thread=False)
+            apply_pragmas(conn)
+            conn.execute("PRAGMA query_only = 1")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, fn, args):
+        return fn(self.connection(), *args)
+
+    def _start_writer(self):
+        with self._writer_lock:
+            if self._writer_thread is None:
+                self._writer_thread = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+                self._writer_thread.start()
+
+    def _submit(self, fn, args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._start_writer()
+        self._writes.put((fn, args, loop, future))
+        return future
+
+    def _writer_loop(self):
+        """
+        Serve queued writes on one connection, committing them in groups.
+
+        Whatever has queued up while the previous group was being written is
+        taken as the next group (at most max_group_size writes), run in one
+        transaction with a savepoint per write, and committed once. A write
+        that raises is rolled back to its savepoint without affecting the rest
+        of its group. Every caller's future is resolved only after the commit,
+        so an awaited write() is durable.
+        """
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        apply_pragmas(conn)
+        self._data_version = _data_version(conn)
+        while True:
+            try:
+                item = self._writes.get(timeout=self.poll_interval)
+            except queue.Empty:
+                # Idle: pick up commits made by other processes
+                self._data_version = _data_version(conn)
+                continue
+            if item is None:
+                break
+            group = [item]
+            while len(group) < self.max_group_size:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._writes.put(None)
+                    break
+                group.append(item)
+
+            outcomes = self._write_group(conn, group)
+            # Own commits never change it, so it only moves for other processes
+            self._data_version = _data_version(conn)
+
+            for loop, future, ok, value in outcomes:
+                loop.call_soon_threadsafe(_resolve, future, ok, value)
+        conn.close()
+
+    def _write_group(self, conn, group):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            group_conn = _GroupConnection(conn)
+            for fn, args, loop, future in group:
+                conn.execute("SAVEPOINT group_write")
+                ok, value = _outcome(fn, group_conn, args)
+                if not ok:
+                    conn.execute("ROLLBACK TO group_write")
+                conn.execute("RELEASE group_write")
+                outcomes.append((loop, future, ok, value))
+            conn.commit()
+        except sqlite3.Error as e:
+            # The group could not be committed, so none of its writes happened
+            conn.rollback()
+            return [(loop, future, False, e) for _, _, loop, future in group]
+        self.group_commits += 1
+        self.grouped_writes += len(group)
+        return outcomes
+
+    async def run(self, fn, *args):
+        """
+        Run fn(conn, *args) on one of the database threads and await its result.
+
+        fn receives the connection owned by the worker thread, so it must do all
+        of its database work before returning.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(self._call, fn, args))
+
+    async def write(self, fn, *args):
+        """
+        Like run(), but fn(conn, *args) runs on the writer thread as part of a
+        group commit and the result is returned once it is committed.
+
+        conn.commit() inside fn is a no-op and conn.rollback() only undoes
+        fn's own changes, so the existing write helpers work unchanged.
+        """
+        return await self._submit(fn, args)
+
+    def data_version(self):
+        """
+        PRAGMA data_version of the writer connection, as last published by
+        the writer thread, or None before it has started.
+
+        All in-process writes use that connection, so the value only changes
+        when another process (e.g. an import script) commits to the database.
+        Reading it never waits on the writer, even in the middle of a long
+        group commit.
+        """
+        self._start_writer()
+        return self._data_version
+
+    def write_stats(self):
+        return {
+            'group_commits': self.group_commits,
+            'grouped_writes': self.grouped_writes,
+            'writes_per_commit': self.grouped_writes / self.group_commits if self.group_commits else 0.0,
+            'queued': self._writes.qsize(),
+        }
+
+    def close_all(self):
+        """
+        Close every connection and stop the database threads.
+
+        The pool stays usable: a fresh executor is put in place, and the
+        connections and writer thread are opened again on first use, so the
+        app can be started again in the same process (e.g. by a second
+        TestClient).
+        """
+        self._executor.shutdown(wait=True)
+        self._executor = self._new_executor()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+        with self._writer_lock:
+            if self._writer_thread is not None:
+                self._writes.put(None)
+                self._writer_thread.join()
+                self._writer_thread = None
+
+
+class _GroupConnection:
+    """Writer connection as seen by one write of a group commit."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def commit(self):
+        # Committed together with the rest of the group
+        pass
+
+    def rollback(self):
+        self._conn.execute("ROLLBACK TO group_write")
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _outcome(fn, conn, args):
+    try:
+        return True, fn(conn, *args)
+    except Exception as e:
+        return False, e
+
+
+def _resolve(future, ok, value):
+    if future.cancelled():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+
+
+def _data_version(conn):
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+pool = ConnectionPool()
+
+
+# FastAPI dependency giving routes access to the shared pool
+def get_db():
+    return pool
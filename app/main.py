@@ -2,7 +2,9 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.db.database import init_db
+from app.db.pool import pool
 from app.api.routes import router as api_router
+from app.api.pagination import NEXT_CURSOR_HEADER
 
 app = FastAPI()
 
@@ -13,6 +15,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],  # Let browsers read the pagination cursor and ETag
 )
 
 # Call the function to initialize the database
@@ -20,6 +23,11 @@ init_db()
 
 app.include_router(api_router)
 
+# Close the pooled database connections when the server stops
+@app.on_event("shutdown")
+def close_db_connections():
+    pool.close_all()
+
 # Run the app using Uvicorn server
 if __name__ == "__main__":
     import uvicorn
@@ -89,8 +89,20 @@ class RawFileMetadataCreate(BaseModel):
 class RawFileCreate(BaseModel):
     dataset_id: int
     path: str
+    sample_id: Optional[int] = None
     metadata: Optional[List[RawFileMetadataCreate]] = []
 
+# A raw file that is no longer on disk, for /remove_raw_files/
+class RawFileRemove(BaseModel):
+    dataset_id: int
+    path: str
+
+# One key/value of a dataset, patient, sample or raw file for the bulk upsert
+class MetadataUpsert(BaseModel):
+    entity_id: int
+    key: str
+    value: str
+
 class MetadataUpdate(BaseModel):
     dataset_id: int
     raw_file_size: str
@@ -0,0 +1,75 @@
+"""
+Requests per second served with the pooled connections of app/db/pool.py
+and with a fresh sqlite3.connect() per query, the way the routes used to
+work. Run from the repository root:
+
+    python -m benchmarks.benchmark_pool
+"""
+import argparse
+import asyncio
+import sqlite3
+
+from benchmarks.common import requests_per_second, scratch_database, seed_project
+
+DATABASE = scratch_database()
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.db.pool import get_db, pool  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+class PerRequestConnections:
+    """Opens and closes a connection around every query, with no pragmas applied."""
+
+    def __init__(self, database):
+        self.database = database
+
+    def _call(self, fn, args):
+        conn = sqlite3.connect(self.database)
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.close()
+
+    async def run(self, fn, *args):
+        return await asyncio.to_thread(self._call, fn, args)
+
+    def data_version(self):
+        # Unknown, so the response cache relies on invalidation alone
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare pooled and per-request SQLite connections.')
+    parser.add_argument('--patients', type=int, default=2000, help='Patients in the seeded project')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and mode')
+    parser.add_argument('--threads', default='1,4', help='Comma-separated client thread counts')
+    args = parser.parse_args()
+
+    project_id, dataset_id = seed_project(DATABASE, args.patients)
+    print(f"{args.patients} patients in {DATABASE}")
+    # A query string of their own keeps every request out of the response
+    # cache and single-flight coalescing, so each one reaches the database
+    endpoints = {
+        'datasets': f"/datasets/?project_id={project_id}&run={{}}",
+        'patients page': f"/patients/?project_id={project_id}&limit=50&run={{}}",
+        'raw files page': f"/raw_files_with_metadata/{dataset_id}?limit=50&run={{}}",
+    }
+    modes = {
+        'per-request': lambda: PerRequestConnections(DATABASE),
+        'pooled': lambda: pool,
+    }
+
+    with TestClient(app) as client:
+        for name, url in endpoints.items():
+            for threads in (int(value) for value in args.threads.split(',')):
+                results = {}
+                for mode, db in modes.items():
+                    app.dependency_overrides[get_db] = db
+                    urls = [url.format(f"{mode}-{threads}-{number}") for number in range(args.requests)]
+                    requests_per_second(client, urls[:50], threads)
+                    results[mode] = requests_per_second(client, urls[50:], threads)
+                app.dependency_overrides.clear()
+                print(f"{name:15s} threads={threads}  per-request {results['per-request']:7.0f} req/s  "
+                      f"pooled {results['pooled']:7.0f} req/s  x{results['pooled'] / results['per-request']:.2f}")
@@ -0,0 +1,69 @@
+"""
+Time of /samples/0 on a project of 100k samples, returned as a
+FastJSONResponse and, the way the route used to, as plain rows that FastAPI
+validates and serializes through response_model. Run from the repository
+root:
+
+    python -m benchmarks.benchmark_samples
+"""
+import argparse
+import statistics
+import time
+from typing import List
+
+from benchmarks.common import scratch_database, seed_project
+
+DATABASE = scratch_database()
+
+from fastapi import APIRouter, Depends  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.api.responses import loads, orjson  # noqa: E402
+from app.api.routes import _get_samples_per_patient  # noqa: E402
+from app.db.pool import ConnectionPool, get_db  # noqa: E402
+from app.main import app  # noqa: E402
+from app.schemas.schemas import Sample  # noqa: E402
+
+validated = APIRouter()
+
+
+@validated.get("/validated/samples/{sample_id}", response_model=List[Sample])
+async def get_samples_validated(sample_id: int, project_id: int, db: ConnectionPool = Depends(get_db)):
+    return await db.run(_get_samples_per_patient, sample_id, project_id)
+
+
+app.include_router(validated)
+
+
+def timings(client, url, repeats):
+    """Seconds taken by each of repeats requests of url, and the last body."""
+    # Untimed, so that neither variant pays for reading the database into cache
+    client.get(f"{url}&run=warmup")
+    times = []
+    for number in range(repeats):
+        start = time.perf_counter()
+        # A query string of its own keeps the request out of single-flight coalescing
+        response = client.get(f"{url}&run={number}")
+        times.append(time.perf_counter() - start)
+        assert response.status_code == 200, url
+    return times, response.content
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time /samples/0 with and without response_model validation.')
+    parser.add_argument('--samples', type=int, default=100000, help='Samples in the seeded project')
+    parser.add_argument('--repeats', type=int, default=5, help='Requests per variant')
+    args = parser.parse_args()
+
+    project_id, _ = seed_project(DATABASE, args.samples // 2, samples_per_patient=2)
+    print(f"{args.samples} samples, orjson {'on' if orjson else 'off'}")
+
+    with TestClient(app) as client:
+        results = {}
+        for name, url in (('response_model', f"/validated/samples/0?project_id={project_id}"),
+                          ('FastJSONResponse', f"/samples/0?project_id={project_id}")):
+            times, body = timings(client, url, args.repeats)
+            results[name] = loads(body)
+            print(f"{name:16s}  median {statistics.median(times) * 1000:8.0f} ms  "
+                  f"best {min(times) * 1000:8.0f} ms  {len(body) / (1024 * 1024):.1f} MB")
+        assert results['response_model'] == results['FastJSONResponse']
@@ -0,0 +1,110 @@
+"""
+Reads and writes per second while a writer adds raw files and readers page
+through /patients_metadata/0, with the pragma profile of app/db/database.py
+(WAL) and with SQLite's default rollback journal. Run from the repository
+root:
+
+    python -m benchmarks.benchmark_wal
+"""
+import argparse
+import random
+import sqlite3
+import threading
+import time
+
+from benchmarks.common import scratch_database, seed_project
+
+DATABASE = scratch_database()
+
+from app.api.routes import _get_patients_metadata  # noqa: E402
+from app.db import database  # noqa: E402
+from app.db.ingest import upsert_raw_files  # noqa: E402
+
+PROFILES = {
+    # SQLite's defaults otherwise: synchronous FULL, no mmap, 2 MiB cache,
+    # and the 5 second busy timeout of sqlite3.connect()
+    'rollback journal': {'journal_mode': 'DELETE'},
+    'wal': database.PRAGMAS,
+}
+
+
+def mixed_load(path, pragmas, project_id, dataset_id, patients, readers, seconds, batch):
+    """
+    Run readers reader threads and one writer for seconds seconds. Returns
+    reads, read latencies, files written and "database is locked" errors.
+    """
+    stop = threading.Event()
+    latencies = []
+    written = [0]
+    errors = [0]
+    lock = threading.Lock()
+
+    def connect():
+        conn = sqlite3.connect(path, check_same_thread=False)
+        database.apply_pragmas(conn, pragmas)
+        return conn
+
+    def read():
+        conn = connect()
+        own = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                _get_patients_metadata(conn, project_id, 0, random.randrange(patients), 50)
+                own.append(time.perf_counter() - start)
+            except sqlite3.OperationalError:
+                with lock:
+                    errors[0] += 1
+        conn.close()
+        with lock:
+            latencies.extend(own)
+
+    def write():
+        conn = connect()
+        number = 0
+        while not stop.is_set():
+            rows = [(dataset_id, f"/bench/{number + offset}.fastq", None, [("md5", "0" * 32)])
+                    for offset in range(batch)]
+            try:
+                upsert_raw_files(conn, rows)
+                conn.commit()
+                number += batch
+            except sqlite3.OperationalError:
+                conn.rollback()
+                with lock:
+                    errors[0] += 1
+        conn.close()
+        written[0] = number
+
+    threads = [threading.Thread(target=read) for _ in range(readers)] + [threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return len(latencies), sorted(latencies), written[0], errors[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare WAL and rollback journal under mixed reads and writes.')
+    parser.add_argument('--patients', type=int, default=5000, help='Patients in the seeded project')
+    parser.add_argument('--readers', type=int, default=4, help='Reader threads')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each run')
+    parser.add_argument('--batch', type=int, default=100, help='Raw files per write transaction')
+    args = parser.parse_args()
+
+    for name, pragmas in PROFILES.items():
+        # A database of its own per profile, since journal_mode is stored in the file
+        path = database.DATABASE = f"{DATABASE}.{name.replace(' ', '_')}"
+        database.init_db()
+        conn = sqlite3.connect(path)
+        conn.execute(f"PRAGMA journal_mode = {pragmas.get('journal_mode', 'DELETE')}")
+        conn.close()
+        project_id, dataset_id = seed_project(path, args.patients)
+
+        reads, latencies, written, errors = mixed_load(
+            path, pragmas, project_id, dataset_id, args.patients, args.readers, args.seconds, args.batch)
+        p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)] if latencies else float('nan')
+        print(f"{name:16s}  {reads / args.seconds:7.0f} reads/s  p99 {p99 * 1000:7.1f} ms  "
+              f"{written / args.seconds:7.0f} files/s written  {errors} locked errors")
@@ -0,0 +1,73 @@
+"""
+Writes per second from many concurrent writers through the pool's writer
+thread, committing each write on its own (max_group_size=1, as before group
+commits) and in groups. Run from the repository root:
+
+    python -m benchmarks.benchmark_writes
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import scratch_database, seed_project
+
+DATABASE = scratch_database()
+
+from app.api.routes import _upsert_metadata, _upsert_raw_file_rows  # noqa: E402
+from app.db import database  # noqa: E402
+from app.db.pool import ConnectionPool  # noqa: E402
+
+
+def metadata_write(dataset_id, writer, number):
+    return _upsert_metadata, 'datasets', [(dataset_id, f"key{writer}-{number}", "value")]
+
+
+def bulk_write(dataset_id, writer, number, files=100):
+    rows = [(dataset_id, f"/bench/{writer}/{number}/{index}.fastq", None, [("md5", "0" * 32)])
+            for index in range(files)]
+    return _upsert_raw_file_rows, rows
+
+
+async def concurrent_writes(pool, writers, writes_per_writer, make_write, dataset_id):
+    async def writer(number):
+        for write in range(writes_per_writer):
+            await pool.write(*make_write(dataset_id, number, write))
+
+    await asyncio.gather(*(writer(number) for number in range(writers)))
+
+
+def writes_per_second(group_size, writers, writes_per_writer, make_write, dataset_id):
+    pool = ConnectionPool(DATABASE, max_group_size=group_size)
+    try:
+        start = time.perf_counter()
+        asyncio.run(concurrent_writes(pool, writers, writes_per_writer, make_write, dataset_id))
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.close_all()
+    return writers * writes_per_writer / elapsed, pool.group_commits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time concurrent writes with and without group commits.')
+    parser.add_argument('--writers', type=int, default=50, help='Concurrent writers')
+    parser.add_argument('--writes', type=int, default=40, help='Writes per writer')
+    parser.add_argument('--bulk-writes', type=int, default=4, help='Writes of 100 files per writer')
+    parser.add_argument('--group-size', type=int, default=64, help='max_group_size of the grouped runs')
+    args = parser.parse_args()
+
+    database.init_db()
+    _, dataset_id = seed_project(DATABASE, 10)
+    workloads = (
+        ('metadata upserts', metadata_write, args.writes),
+        ('100-file upserts', bulk_write, args.bulk_writes),
+    )
+    for synchronous in ('NORMAL', 'FULL'):
+        # Read by apply_pragmas whenever the writer thread opens its connection
+        database.PRAGMAS['synchronous'] = synchronous
+        for name, make_write, writes in workloads:
+            results = {}
+            for group_size in (1, args.group_size):
+                results[group_size] = writes_per_second(group_size, args.writers, writes, make_write, dataset_id)
+            (single, _), (grouped, commits) = results[1], results[args.group_size]
+            print(f"synchronous={synchronous:6s} {name:16s}  one commit each {single:8.0f} writes/s  "
+                  f"grouped {grouped:8.0f} writes/s ({args.writers * writes} writes in {commits} commits)")
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def scratch_database():
+    """
+    Point the app at a new database in a temporary directory, so benchmarks
+    never write to data/data_redmane.db. Call it before importing any app
+    module: the database path is read when they are imported.
+    """
+    path = os.path.join(tempfile.mkdtemp(prefix="redmane-bench-"), "redmane.db")
+    os.environ["REDMANE_DATABASE"] = path
+    return path
+
+
+def seed_project(path, patients, samples_per_patient=2, metadata_per_entity=2):
+    """
+    Add a project with patients, their samples and metadata to the database
+    at path, and a dataset with one raw file per sample, in bulk. Returns the
+    ids of the project and dataset. The tests seed their databases with it
+    too, through conftest.
+    """
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO projects (name, status) VALUES ('seeded', 'Active')")
+    project_id = cur.lastrowid
+    cur.execute("INSERT INTO datasets (project_id, name) VALUES (?, 'seeded')", (project_id,))
+    dataset_id = cur.lastrowid
+    cur.execute("INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, 'sample_info_stored', 'filename')",
+                (dataset_id,))
+
+    cur.executemany("INSERT INTO patients (project_id, ext_patient_id, ext_patient_url) VALUES (?, ?, ?)",
+                    [(project_id, f"P{project_id}-{number}", f"https://example.org/patients/{project_id}-{number}")
+                     for number in range(patients)])
+    patient_ids = [row[0] for row in cur.execute("SELECT id FROM patients WHERE project_id = ? ORDER BY id",
+                                                 (project_id,))]
+    cur.executemany("INSERT INTO patients_metadata (patient_id, key, value) VALUES (?, ?, ?)",
+                    [(patient_id, f"key{key}", "value")
+                     for patient_id in patient_ids for key in range(metadata_per_entity)])
+    # (patient number, sample number) of each sample, in the order they are inserted
+    numbers = [(number, sample) for number in range(patients) for sample in range(samples_per_patient)]
+    cur.executemany("INSERT INTO samples (patient_id, ext_sample_id, ext_sample_url) VALUES (?, ?, ?)",
+                    [(patient_ids[number], f"S{project_id}-{number}-{sample}",
+                      f"https://example.org/samples/{project_id}-{number}-{sample}")
+                     for number, sample in numbers])
+    sample_ids = [row[0] for row in cur.execute('''
+        SELECT s.id FROM samples s JOIN patients p ON p.id = s.patient_id
+        WHERE p.project_id = ? ORDER BY s.id
+    ''', (project_id,))]
+    cur.executemany("INSERT INTO samples_metadata (sample_id, key, value) VALUES (?, ?, ?)",
+                    [(sample_id, f"key{key}", "value")
+                     for sample_id in sample_ids for key in range(metadata_per_entity)])
+    cur.executemany("INSERT INTO raw_files (dataset_id, path, sample_id) VALUES (?, ?, ?)",
+                    [(dataset_id, f"/data/{project_id}/{number}/{sample}.fastq", sample_id)
+                     for (number, sample), sample_id in zip(numbers, sample_ids)])
+    conn.commit()
+    conn.close()
+    return project_id, dataset_id
+
+
+def requests_per_second(client, urls, threads=1):
+    """Get every url from threads threads and return how many were served per second."""
+    def get(url):
+        assert client.get(url).status_code == 200, url
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(get, urls))
+    return len(urls) / (time.perf_counter() - start)
@@ -0,0 +1,55 @@
+import argparse
+import os
+import time
+
+import fastq_stats
+from create_fastq_size import create_large_fastq_file
+from scanner import scan
+
+def line_by_line(path):
+    """The statistics the straightforward way, one Python step per line."""
+    reads = bases = quality_sum = q30_bases = 0
+    with fastq_stats.open_fastq(path) as f:
+        for number, line in enumerate(f):
+            line = line.rstrip(b'\n')
+            if number % 4 == 0:
+                reads += 1
+            elif number % 4 == 1:
+                bases += len(line)
+            elif number % 4 == 3:
+                quality_sum += sum(line) - len(line) * fastq_stats.PHRED_OFFSET
+                q30_bases += sum(1 for value in line if value >= fastq_stats.PHRED_OFFSET + 30)
+    return fastq_stats.FastqStats(reads, bases, quality_sum, q30_bases)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time FASTQ statistics on files from create_fastq_size.py.')
+    parser.add_argument('--root', default='fastq_corpus', help='Corpus directory; created if missing')
+    parser.add_argument('--files', type=int, default=8, help='Number of files in a created corpus')
+    parser.add_argument('--size-mb', type=int, default=64, help='Size of each created file')
+    parser.add_argument('--processes', default='1,2,4,8', help='Comma-separated process counts')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.root):
+        os.makedirs(args.root)
+        print(f"Creating {args.files} files of {args.size_mb} MB under {args.root}")
+        for index in range(args.files):
+            create_large_fastq_file(os.path.join(args.root, f"sample{index}.fastq"), args.size_mb)
+    files = scan(args.root, '.fastq').files
+    total_mb = sum(file.size for file in files) / (1024 * 1024)
+    print(f"{len(files)} files, {total_mb:.0f} MB, numpy {'on' if fastq_stats.numpy else 'off'}")
+
+    start = time.perf_counter()
+    expected = line_by_line(files[0].path)
+    elapsed = time.perf_counter() - start
+    print(f"line by line  {files[0].size / (1024 * 1024) / elapsed:8.1f} MB/s (one file)")
+
+    start = time.perf_counter()
+    assert fastq_stats.fastq_stats(files[0].path) == expected
+    elapsed = time.perf_counter() - start
+    print(f"chunked       {files[0].size / (1024 * 1024) / elapsed:8.1f} MB/s (one file)")
+
+    for processes in (int(value) for value in args.processes.split(',')):
+        start = time.perf_counter()
+        fastq_stats.fastq_stats_files(files, processes=processes)
+        elapsed = time.perf_counter() - start
+        print(f"processes={processes:2d}  {total_mb / elapsed:8.1f} MB/s")
@@ -0,0 +1,78 @@
+import argparse
+import os
+import time
+
+import scanner
+
+def create_tree(root, top_dirs, sub_dirs, files_per_dir):
+    """Create top_dirs x sub_dirs directories of empty files, half of them .fastq."""
+    for a in range(top_dirs):
+        for b in range(sub_dirs):
+            directory = os.path.join(root, f"project{a}", f"sample{b}")
+            os.makedirs(directory, exist_ok=True)
+            for c in range(files_per_dir):
+                name = f"read{c}.fastq" if c % 2 else f"read{c}.txt"
+                open(os.path.join(directory, name), 'w').close()
+
+def add_latency(latency):
+    """
+    Emulate a network filesystem by delaying every readdir and stat.
+
+    The sleep releases the GIL like a real blocking syscall does, so this
+    shows how the traversal overlaps round trips, not local CPU throughput.
+    """
+    scandir = os.scandir
+
+    class SlowEntry:
+        def __init__(self, entry):
+            self._entry = entry
+            self.name = entry.name
+            self.path = entry.path
+
+        def is_dir(self, follow_symlinks=True):
+            return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+        def is_file(self, follow_symlinks=True):
+            return self._entry.is_file(follow_symlinks=follow_symlinks)
+
+        def stat(self, follow_symlinks=True):
+            time.sleep(latency)
+            return self._entry.stat(follow_symlinks=follow_symlinks)
+
+    class SlowScandir:
+        def __init__(self, path):
+            time.sleep(latency)
+            self._entries = scandir(path)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self._entries.close()
+
+        def __iter__(self):
+            return (SlowEntry(entry) for entry in self._entries)
+
+    scanner.os.scandir = SlowScandir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time scanner.scan on a synthetic tree at several thread counts.')
+    parser.add_argument('--root', default='synthetic_tree', help='Tree to scan; created if missing')
+    parser.add_argument('--files', type=int, default=1000000, help='Number of files in a created tree')
+    parser.add_argument('--threads', default='1,2,4,8,16,32', help='Comma-separated thread counts')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Emulated per-call filesystem latency')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.root):
+        print(f"Creating {args.files} files under {args.root}")
+        create_tree(args.root, 100, 100, max(1, args.files // 10000))
+    if args.latency_ms:
+        add_latency(args.latency_ms / 1000)
+
+    baseline = None
+    for threads in (int(value) for value in args.threads.split(',')):
+        start = time.perf_counter()
+        result = scanner.scan(args.root, '.fastq', threads=threads)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"threads={threads:3d}  {elapsed:8.2f}s  {len(result.files)} files  speedup {baseline / elapsed:5.1f}x")
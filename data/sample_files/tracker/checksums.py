@@ -0,0 +1,101 @@
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# xxhash is optional; its XXH3 digest is several times faster than md5.
+# Without it BLAKE2b, from the standard library, is used instead.
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Bytes read per step; large reads keep NFS/Lustre streaming
+BUFFER_SIZE = 8 * 1024 * 1024
+
+# Name of the fast digest, stored next to it so a cache written with the
+# other algorithm is recognised
+FAST_ALGORITHM = 'xxh3_128' if xxhash is not None else 'blake2b'
+
+
+def _fast_hash():
+    return xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b()
+
+
+def file_checksums(path):
+    """
+    (md5, FAST_ALGORITHM, fast digest) of path, as hex digests.
+
+    The file is read once, in BUFFER_SIZE chunks into a reused buffer, and
+    each chunk feeds both hashes.
+    """
+    md5 = hashlib.md5()
+    fast = _fast_hash()
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            md5.update(view[:count])
+            fast.update(view[:count])
+    return md5.hexdigest(), FAST_ALGORITHM, fast.hexdigest()
+
+
+def _checksum_file(path):
+    # Runs in a worker process; errors are returned as text so that they
+    # pickle whatever their type
+    try:
+        return path, file_checksums(path), None
+    except OSError as e:
+        return path, None, str(e)
+
+
+def cache_key(file):
+    return file.device, file.inode, file.size, file.mtime_ns
+
+
+def worker_pool(processes):
+    # Forked workers need nothing from the caller's __main__; where fork is
+    # unavailable threads are used instead, which still overlap since
+    # hashlib releases the GIL while hashing large buffers
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork'))
+    return ThreadPoolExecutor(max_workers=processes)
+
+
+def checksum_files(files, cache, processes=None):
+    """
+    Checksums of the ScannedFiles files, as ({path: (md5, algorithm, digest)},
+    {path: error}).
+
+    A file whose (device, inode, size, mtime) is in cache (see
+    Manifest.checksums) with the current algorithm is not read again, even
+    if it has been renamed. The rest are hashed across a pool of processes,
+    largest first so that one big file does not run on alone at the end.
+    """
+    checksums = {}
+    to_hash = []
+    for file in files:
+        cached = cache.get(cache_key(file))
+        if cached is not None and cached[1] == FAST_ALGORITHM:
+            checksums[file.path] = cached
+        else:
+            to_hash.append(file)
+    to_hash.sort(key=lambda file: file.size, reverse=True)
+    paths = [file.path for file in to_hash]
+
+    errors = {}
+    # Starting a pool costs more than hashing a single file in place
+    executor = None if processes == 1 or len(paths) <= 1 else worker_pool(processes)
+    try:
+        results = executor.map(_checksum_file, paths) if executor else map(_checksum_file, paths)
+        for path, checksum, error in results:
+            if error is None:
+                checksums[path] = checksum
+            else:
+                errors[path] = error
+    finally:
+        if executor:
+            executor.shutdown()
+    return checksums, errors
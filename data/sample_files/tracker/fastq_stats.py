@@ -0,0 +1,297 @@
+import gzip
+import math
+import os
+import zlib
+from collections import namedtuple
+
+from checksums import worker_pool
+
+# numpy is optional; it computes the statistics of a whole chunk with a few
+# vector operations. Without it each chunk is split into lines in Python.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bytes parsed per step
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Names of the files whose statistics are collected
+FASTQ_SUFFIXES = ('.fastq', '.fq', '.fastq.gz', '.fq.gz')
+
+# Quality characters are Phred scores offset by 33 (Sanger / Illumina 1.8+)
+PHRED_OFFSET = 33
+
+# Estimates sample ESTIMATE_RECORDS records at each of ESTIMATE_WINDOWS evenly
+# spaced offsets, reading SAMPLE_READ_SIZE bytes at a time and at most
+# MAX_WINDOW_SIZE per window
+ESTIMATE_WINDOWS = 16
+ESTIMATE_RECORDS = 1000
+SAMPLE_READ_SIZE = 256 * 1024
+MAX_WINDOW_SIZE = 16 * 1024 * 1024
+
+# Normal quantile of the 95% confidence bounds reported with estimates
+CONFIDENCE_Z = 1.96
+
+# Maps quality characters of Q30 and above to b'1' and the rest to b'0'
+_Q30_TABLE = bytes(b'1'[0] if value >= PHRED_OFFSET + 30 else b'0'[0] for value in range(256))
+
+FastqStats = namedtuple('FastqStats', ['reads', 'bases', 'quality_sum', 'q30_bases'])
+
+# Extrapolated FastqStats with (low, high) bounds on reads and bases;
+# estimated is False when the file was small enough to parse in full
+FastqEstimate = namedtuple('FastqEstimate', ['stats', 'reads_bounds', 'bases_bounds', 'estimated'])
+
+
+def is_fastq(path):
+    return path.endswith(FASTQ_SUFFIXES)
+
+
+def stats_metadata(stats, method="exact"):
+    """
+    Raw file metadata entries for the FastqStats of a file. method, stored
+    as fastq_stats_method, says whether they are exact or an estimate.
+    """
+    mean_quality = stats.quality_sum / stats.bases if stats.bases else 0
+    q30_fraction = stats.q30_bases / stats.bases if stats.bases else 0
+    return [
+        {"metadata_key": "read_count", "metadata_value": str(stats.reads)},
+        {"metadata_key": "total_bases", "metadata_value": str(stats.bases)},
+        {"metadata_key": "mean_quality", "metadata_value": f"{mean_quality:.2f}"},
+        {"metadata_key": "q30_fraction", "metadata_value": f"{q30_fraction:.4f}"},
+        {"metadata_key": "fastq_stats_method", "metadata_value": method},
+    ]
+
+
+def estimate_metadata(estimate):
+    """Raw file metadata entries for a FastqEstimate, bounds included."""
+    if not estimate.estimated:
+        return stats_metadata(estimate.stats)
+    return stats_metadata(estimate.stats, "estimate") + [
+        {"metadata_key": "read_count_95ci", "metadata_value": "%d-%d" % estimate.reads_bounds},
+        {"metadata_key": "total_bases_95ci", "metadata_value": "%d-%d" % estimate.bases_bounds},
+    ]
+
+
+def open_fastq(path):
+    """path opened for binary reads, decompressing it if it is gzip."""
+    f = open(path, 'rb')
+    if f.read(2) == b'\x1f\x8b':
+        f.seek(0)
+        return gzip.GzipFile(fileobj=f)
+    f.seek(0)
+    return f
+
+
+def _chunk_stats_numpy(data, first_line):
+    array = numpy.frombuffer(data, dtype=numpy.uint8)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(array == 10)[:-1] + 1))
+    # Line lengths including the newline, which each line ends with
+    spans = numpy.diff(numpy.append(starts, len(array)))
+    kinds = (numpy.arange(len(starts)) + first_line) % 4
+    quality_lines = kinds == 3
+    # Every byte of the quality lines, gathered with one mask; their newlines
+    # come along and are taken off the sums below
+    qualities = array[numpy.repeat(quality_lines, spans)]
+    quality_line_count = int(numpy.count_nonzero(quality_lines))
+    quality_bases = len(qualities) - quality_line_count
+    return FastqStats(
+        reads=int(numpy.count_nonzero(kinds == 0)),
+        bases=int(spans[kinds == 1].sum()) - int(numpy.count_nonzero(kinds == 1)),
+        quality_sum=int(qualities.sum(dtype=numpy.int64)) - quality_bases * PHRED_OFFSET - quality_line_count * 10,
+        q30_bases=int(numpy.count_nonzero(qualities >= PHRED_OFFSET + 30)),
+    )
+
+
+def _chunk_stats_python(data, first_line):
+    lines = data.split(b'\n')[:-1]
+    sequences = lines[(1 - first_line) % 4::4]
+    qualities = b''.join(lines[(3 - first_line) % 4::4])
+    return FastqStats(
+        reads=len(lines[-first_line % 4::4]),
+        bases=sum(map(len, sequences)),
+        quality_sum=sum(qualities) - len(qualities) * PHRED_OFFSET,
+        q30_bases=qualities.translate(_Q30_TABLE).count(b'1'),
+    )
+
+
+def fastq_stats(path):
+    """
+    FastqStats of the FASTQ (or gzip FASTQ) at path.
+
+    The file is read in CHUNK_SIZE blocks cut at the last newline, and each
+    block is handled as a whole: with numpy its line boundaries, per-line
+    byte sums and Q30 counts come from vector operations over the block,
+    so no Python code runs per read. Records are taken as four lines each.
+    """
+    chunk_stats = _chunk_stats_numpy if numpy is not None else _chunk_stats_python
+    totals = [0, 0, 0, 0]
+    line = 0
+    rest = b''
+    with open_fastq(path) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                data = rest + b'\n' if rest else b''
+            else:
+                end = chunk.rfind(b'\n') + 1
+                if not end:
+                    rest += chunk
+                    continue
+                data = rest + chunk[:end]
+                rest = chunk[end:]
+            if data:
+                stats = chunk_stats(data, line)
+                totals = [total + value for total, value in zip(totals, stats)]
+                line += data.count(b'\n')
+            if not chunk:
+                return FastqStats(*totals)
+
+
+def _is_record(lines, index):
+    # A header is an @ line two lines before a + line, with a sequence as
+    # long as its qualities; a quality line starting with @ is followed two
+    # lines on by a sequence, not a + line
+    return (lines[index].startswith(b'@') and lines[index + 2].startswith(b'+')
+            and len(lines[index + 1]) == len(lines[index + 3]))
+
+
+def sample_records(f, offset, records):
+    """
+    Statistics of up to records records from the first record starting at
+    or after offset in the plain FASTQ f, as (records, bytes, bases,
+    quality_sum, q30_bases).
+    """
+    f.seek(offset)
+    data = b''
+    while True:
+        block = f.read(SAMPLE_READ_SIZE)
+        data += block
+        lines = data.split(b'\n')
+        if block:
+            # The last line may be cut short
+            lines.pop()
+        # Unless at the start, the first line may be the end of another one
+        first = 0 if offset == 0 else 1
+        start = next((index for index in range(first, len(lines) - 3) if _is_record(lines, index)), None)
+        if not block or len(data) >= MAX_WINDOW_SIZE or (
+                start is not None and len(lines) - start >= 4 * records):
+            break
+    if start is None:
+        return 0, 0, 0, 0, 0
+
+    count = size = bases = quality_sum = q30_bases = 0
+    for index in range(start, len(lines) - 3, 4):
+        if count == records or not lines[index].startswith(b'@'):
+            break
+        sequence, quality = lines[index + 1], lines[index + 3]
+        count += 1
+        size += sum(len(line) + 1 for line in lines[index:index + 4])
+        bases += len(sequence)
+        quality_sum += sum(quality) - len(quality) * PHRED_OFFSET
+        q30_bases += quality.translate(_Q30_TABLE).count(b'1')
+    return count, size, bases, quality_sum, q30_bases
+
+
+def _ratio_bounds(numerators, denominators):
+    """
+    Ratio of the sums of numerators and denominators over the windows, and
+    its standard error treating each window as one sample (the usual ratio
+    estimator for cluster samples).
+    """
+    total_numerator, total_denominator = sum(numerators), sum(denominators)
+    ratio = total_numerator / total_denominator
+    windows = len(numerators)
+    if windows < 2:
+        return ratio, 0.0
+    residuals = sum((numerator - ratio * denominator) ** 2
+                    for numerator, denominator in zip(numerators, denominators))
+    return ratio, math.sqrt(windows / (windows - 1) * residuals) / total_denominator
+
+
+def estimate_fastq_stats(path, windows=ESTIMATE_WINDOWS, records=ESTIMATE_RECORDS):
+    """
+    FastqEstimate of the plain FASTQ at path from a sample of its records.
+
+    records records are parsed after each of windows evenly spaced byte
+    offsets, resynchronising on the first record boundary after each. Reads
+    and bases are extrapolated from the file size with the sampled bytes per
+    read and bases per byte; their 95% bounds come from how much those
+    ratios vary between windows. Quality is the mean over the sample. A file
+    too small to be worth sampling is parsed in full.
+
+    gzip files cannot be read from an arbitrary offset, so they raise
+    ValueError.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if f.read(2) == b'\x1f\x8b':
+            raise ValueError("gzip FASTQ cannot be sampled; collect exact statistics instead")
+        if size <= windows * SAMPLE_READ_SIZE * 4:
+            stats = fastq_stats(path)
+            return FastqEstimate(stats, (stats.reads, stats.reads), (stats.bases, stats.bases), False)
+        samples = [sample_records(f, size * window // windows, records) for window in range(windows)]
+    samples = [sample for sample in samples if sample[0]]
+    if not samples:
+        raise ValueError("no FASTQ records found")
+
+    counts, sizes, bases, quality_sums, q30_bases = zip(*samples)
+    bytes_per_read, bytes_per_read_error = _ratio_bounds(sizes, counts)
+    bases_per_byte, bases_per_byte_error = _ratio_bounds(bases, sizes)
+    total_bases = size * bases_per_byte
+    stats = FastqStats(
+        reads=round(size / bytes_per_read),
+        bases=round(total_bases),
+        quality_sum=round(total_bases * sum(quality_sums) / sum(bases)),
+        q30_bases=round(total_bases * sum(q30_bases) / sum(bases)),
+    )
+    bytes_per_read_margin = CONFIDENCE_Z * bytes_per_read_error
+    bases_per_byte_margin = CONFIDENCE_Z * bases_per_byte_error
+    reads_bounds = (
+        math.floor(size / (bytes_per_read + bytes_per_read_margin)),
+        math.ceil(size / max(bytes_per_read - bytes_per_read_margin, 1)),
+    )
+    bases_bounds = (
+        max(math.floor(size * (bases_per_byte - bases_per_byte_margin)), 0),
+        math.ceil(size * (bases_per_byte + bases_per_byte_margin)),
+    )
+    return FastqEstimate(stats, reads_bounds, bases_bounds, True)
+
+
+def _fastq_stats_file(path):
+    # Runs in a worker process, like checksums._checksum_file
+    try:
+        return path, fastq_stats(path), None
+    except (OSError, EOFError, zlib.error) as e:
+        return path, None, str(e)
+
+
+def _estimate_file(path):
+    try:
+        return path, estimate_fastq_stats(path), None
+    except (OSError, ValueError) as e:
+        return path, None, str(e)
+
+
+def fastq_stats_files(files, processes=None, estimate=False):
+    """
+    FastqStats of the ScannedFiles files, as ({path: FastqStats}, {path: error}),
+    parsed across a pool of processes, largest first. With estimate they are
+    FastqEstimates, from samples of each file (see estimate_fastq_stats).
+    """
+    stats_file = _estimate_file if estimate else _fastq_stats_file
+    paths = [file.path for file in sorted(files, key=lambda file: file.size, reverse=True)]
+    stats = {}
+    errors = {}
+    executor = None if processes == 1 or len(paths) <= 1 else worker_pool(processes)
+    try:
+        results = executor.map(stats_file, paths) if executor else map(stats_file, paths)
+        for path, file_stats, error in results:
+            if error is None:
+                stats[path] = file_stats
+            else:
+                errors[path] = error
+    finally:
+        if executor:
+            executor.shutdown()
+    return stats, errors
@@ -1,38 +1,16 @@
 import requests
 from datetime import datetime
-import os,re
 import requests
 import argparse
-import subprocess
-import platform
+import hashlib
 import json
+import zlib
 
-def get_total_size(extension,directory):
-    total_size = 0
-    for root, dirs, files in os.walk('.'):
-        for file in files:
-            if file.endswith(extension):
-                file_path = os.path.join(root, file)
-                total_size += os.path.getsize(file_path)
-    return total_size
-
-def find_files(directory, extension=".fastq"):
-    """
-    Recursively search for files with the given extension in the specified directory.
-    
-    Args:
-    directory (str): The root directory to start the search from.
-    extension (str): The file extension to search for (default is ".fastq").
-    
-    Returns:
-    list: A list of paths to files matching the extension.
-    """
-    matches = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(extension):
-                matches.append(os.path.join(root, file))
-    return matches
+from checksums import checksum_files
+from fastq_stats import estimate_metadata, fastq_stats_files, is_fastq, stats_metadata
+from manifest import Manifest, changed_files, removed_paths
+from matching import HeaderMatcher, SampleMatcher
+from scanner import scan
 
 def get_dataset_metadata(url):
     response = requests.get(url)
@@ -73,29 +51,38 @@ def get_sample_data(url):
     
     return result
 
-def check_patient_in_filename(filename, ext_patient_id):
+def raw_file_record(path, dataset_id, samples):
     """
-    Check if ext_patient_id is found in the filename, treating spaces as wildcards.
-    
-    Args:
-    filename (str): The filename.
-    ext_patient_id (str): The ext_patient_id to search for, with spaces treated as wildcards.
-    
-    Returns:
-    bool: True if the ext_patient_id is found in the filename, False otherwise.
+    Record for /add_raw_files/ linking path to one or more samples.
+
+    The first sample is stored as the file's sample_id; every linked sample
+    is listed in the 'sample_ids' metadata.
     """
-    # Create a regex pattern to match ext_patient_id with spaces as wildcards
-    pattern = re.compile(re.escape(ext_patient_id).replace(r'\ ', '.*'))
-    
-    if pattern.search(filename):
-        return True
-    
-    return False
+    sample_ids = [str(sample["sample_id"]) for sample in samples]
+    return {
+        "path": path,
+        "dataset_id": dataset_id,
+        "metadata": [
+            {"metadata_key": "sample_id", "metadata_value": sample_ids[0]},
+            {"metadata_key": "sample_ids", "metadata_value": ",".join(sample_ids)},
+        ],
+    }
+
+def matching_fingerprint(*settings):
+    """Digest of everything that decides how files are matched and what is sent for them."""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
 
 parser = argparse.ArgumentParser(description='Search for patient or sample IDs in file names.')
 parser.add_argument('--directory', type=str, help='The root directory to search')
 parser.add_argument('--dataset_id', type=int, required=True, help='The dataset ID to use')
 parser.add_argument('--project_id', type=int, required=True, help='The project ID to use')
+parser.add_argument('--threads', type=int, default=1, help='Directories listed in parallel; raise on NFS/Lustre')
+parser.add_argument('--manifest', type=str, help='Manifest of the previous run (default: manifest_dataset_<dataset_id>.db)')
+parser.add_argument('--full', action='store_true', help='Re-read every directory and re-send every file')
+parser.add_argument('--checksums', action='store_true', help='Send md5 and fast checksums of the linked files')
+parser.add_argument('--fastq_stats', nargs='?', const='exact', choices=['exact', 'estimate'],
+                    help='Send read counts, bases and quality of linked FASTQs; "estimate" samples each file')
+parser.add_argument('--processes', type=int, help='Files checksummed or parsed in parallel (default: one per CPU)')
 args = parser.parse_args()
 
 directory_to_search = args.directory
@@ -116,23 +103,21 @@ sample_info_stored = dataset_metadata["sample_info_stored"]
 raw_file_extensions = dataset_metadata["raw_file_extensions"]
 extension = raw_file_extensions.lstrip("*")  # Remove the asterisk to get the actual extension
 
-total_size_bytes = get_total_size(extension,directory_to_search)
-total_size_mb = total_size_bytes / (1024 * 1024)
-print(f"Total size of files with extension '{extension}': {total_size_mb:.2f} MB")
-
-
-# Run the command and capture the output
-# Check the operating system
-os_type = platform.system()
+# The manifest of the previous run lets unchanged directories be skipped
+manifest = Manifest(args.manifest or f"manifest_dataset_{dataset_id}.db", dataset_id, directory_to_search, extension)
+known_files = manifest.files()
 
-if os_type == 'Linux':
-    command = ['du', '--max-depth=1', '-m', directory_to_search]
-elif os_type == 'Darwin':  # macOS
-    command = ['du', '-d', '1', '-m', directory_to_search]
-else:
-    raise OSError(f"Unsupported operating system: {os_type}")
+# One pass over the directory collects the matching files and their sizes
+scan_result = scan(directory_to_search, extension, threads=args.threads,
+                   previous=None if args.full else manifest.listings())
+print(f"Reused {scan_result.reused} of {len(scan_result.listings)} directories from the manifest")
 
-result = subprocess.run(command, capture_output=True, text=True)
+total_size_bytes = scan_result.total_size
+total_size_mb = total_size_bytes / (1024 * 1024)
+print(f"Total size of files with extension '{extension}': {total_size_mb:.2f} MB")
+print(f"Allocated on disk: {scan_result.total_allocated / (1024 * 1024):.2f} MB")
+for directory, (count, size, allocated) in sorted(scan_result.directories.items()):
+    print(f"  {directory}: {count} files, {size / (1024 * 1024):.2f} MB")
 
 # Get today's date
 today_date = datetime.now().strftime('%Y-%m-%d')
@@ -144,38 +129,109 @@ update_dataset_metadata_size = {
     }
 
 
-# Find files
-found_files = find_files(directory_to_search, extension)
+# New samples or other stages can change the outcome for any file, so
+# every file is matched again when they differ from the last run's
+matching = matching_fingerprint(sorted(sample_data, key=lambda sample: sample["sample_id"]),
+                                sample_info_stored, args.checksums, args.fastq_stats)
+rematch = args.full or manifest.matching != matching
+if rematch and not args.full and manifest.matching is not None:
+    print("Samples or stages changed since the last run; matching every file again")
+
+# Only new, changed or unprocessed files are linked and sent; removed ones are deleted
+changed = scan_result.files if rematch else changed_files(scan_result, known_files)
+# Files under a directory that could not be read are kept, not removed
+removed_files = removed_paths(scan_result, known_files)
+for directory in scan_result.failed:
+    print(f"Could not read {directory}; keeping the files known under it")
+print(f"{len(changed)} files to match, {len(removed_files)} removed")
+
+found_files = [file.path for file in changed]
 
 update_raw_files = [] 
+# Files that could not be matched, retried by the next run
+unmatched_files = set()
 
 if sample_info_stored == "header":
-    # Print the found files
-    for file in found_files:
-        try:
-            with open(file, 'r') as file:
-                header = file.readline().strip()
-        except Exception as e:
-            print(f"Error reading file {filename}: {e}")
-
-        components = re.split(r'\s+', header.strip())
-        for data in sample_data:
-            if data["ext_sample_id"] in components:
-                status = "sample_found"
-                update_raw_files.append({"raw_file": file.name,"sample_id":data["sample_id"],"dataset_id":dataset_id,"project_id":project_id})
-                
+    # Headers are read in parallel and matched with one set intersection each
+    matcher = HeaderMatcher(sample_data)
+    for file, samples, error in matcher.match_files(found_files, threads=args.threads):
+        if error is not None:
+            print(f"Error reading file {file}: {error}")
+            unmatched_files.add(file)
+        elif samples:
+            update_raw_files.append(raw_file_record(file, dataset_id, samples))
 
 if sample_info_stored == "filename":
-    # Print the found files
+    # One automaton over all sample and patient IDs, built once for all files
+    matcher = SampleMatcher(sample_data)
     for file in found_files:
-        status = "Not found"
-        for data in sample_data:
-            if data["ext_sample_id"] in file:
-                update_raw_files.append({"path": file,"dataset_id":dataset_id,"metadata":[{"metadata_key": "sample_id","metadata_value":str(data["sample_id"])}]})
-            elif check_patient_in_filename(file, data["ext_patient_id"]):
-                status = "patient_found"
-                update_raw_files.append({"path": file,"dataset_id":dataset_id,"metadata":[{"metadata_key": "sample_id","metadata_value":str(data["sample_id"])}]})
-                break
+        samples = matcher.match(file)
+        if samples:
+            update_raw_files.append(raw_file_record(file, dataset_id, samples))
+
+# Samples linked in this run, recorded in the manifest once sent
+linked_samples = {path: None for path in found_files if path not in unmatched_files}
+for record in update_raw_files:
+    for metadata in record.get("metadata", []):
+        if metadata["metadata_key"] == "sample_id":
+            linked_samples[record["path"]] = int(metadata["metadata_value"])
+
+def linked_sample(path):
+    if path in linked_samples:
+        return linked_samples[path]
+    return known_files[path][3] if path in known_files else None
+
+records = {record["path"]: record for record in update_raw_files}
+
+def record_for(path):
+    """The record sent for path, added when only its checksums or statistics are new."""
+    if path not in records:
+        # Without a sample_id the server keeps the file's link and other metadata
+        records[path] = {"path": path, "dataset_id": dataset_id, "metadata": []}
+        update_raw_files.append(records[path])
+    return records[path]
+
+# Checksums and statistics cover every linked file, not just the ones matched
+# in this run, so turning a stage on also fills in the files already tracked
+linked_files = [file for file in scan_result.files
+                if file.path not in unmatched_files and linked_sample(file.path) is not None]
+sent_checksums = {}
+sent_stats = {}
+
+if args.checksums:
+    # The manifest caches digests by device, inode, size and mtime, so
+    # unchanged content is never re-read; a digest is only sent with a
+    # record that is sent anyway or when the server does not have it yet
+    checksums, checksum_errors = checksum_files(linked_files, manifest.checksums(), processes=args.processes)
+    for path, error in checksum_errors.items():
+        print(f"Error checksumming file {path}: {error}")
+    manifest.save_checksums(linked_files, checksums)
+    for path, (md5, algorithm, digest) in checksums.items():
+        if path in records or known_files.get(path, (None,) * 7)[5] != md5:
+            record = record_for(path)
+            record["metadata"].append({"metadata_key": "md5", "metadata_value": md5})
+            record["metadata"].append({"metadata_key": algorithm, "metadata_value": digest})
+            sent_checksums[path] = md5
+
+if args.fastq_stats:
+    # Every linked FASTQ is parsed in full, one file per process, or with
+    # "estimate" sampled at a few offsets and marked as an estimate. Files
+    # whose statistics the server has for their current content are skipped;
+    # exact statistics are never replaced by an estimate.
+    estimate = args.fastq_stats == "estimate"
+    content_changed = {file.path for file in changed_files(scan_result, known_files)}
+    fastq_files = [
+        file for file in linked_files
+        if is_fastq(file.path) and (args.full or file.path in content_changed
+                                    or known_files[file.path][6] not in (args.fastq_stats, "exact"))
+    ]
+    stats, stats_errors = fastq_stats_files(fastq_files, processes=args.processes, estimate=estimate)
+    for path, error in stats_errors.items():
+        print(f"Error reading FASTQ {path}: {error}")
+    to_metadata = estimate_metadata if estimate else stats_metadata
+    for path, file_stats in stats.items():
+        record_for(path)["metadata"].extend(to_metadata(file_stats))
+        sent_stats[path] = "estimate" if estimate and file_stats.estimated else "exact"
 
 print(json.dumps(update_raw_files,indent=2))
 print(json.dumps(update_dataset_metadata_size,indent=2))
@@ -192,8 +248,36 @@ print(f"Metadata update response: {response.status_code} {response.reason}")
 
 
 
-# Send POST request to add raw files
-add_raw_files_url = 'http://localhost:8888/add_raw_files/'
-response = requests.post(add_raw_files_url, headers=headers, json=update_raw_files)
-response.raise_for_status()
-print(f"Raw files update response: {response.status_code} {response.reason}")
+def ndjson_gzip_body(records):
+    """Yield records as gzip-compressed NDJSON, for a streamed request body."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for record in records:
+        data = compressor.compress(json.dumps(record).encode() + b"\n")
+        # An empty chunk would end a chunked request early
+        if data:
+            yield data
+    yield compressor.flush()
+
+# Stream the raw files to the API, which commits them in chunks as they arrive
+add_raw_files_url = 'http://localhost:8888/add_raw_files/stream'
+stream_headers = {
+    'accept': 'application/json',
+    'Content-Type': 'application/x-ndjson',
+    'Content-Encoding': 'gzip'
+}
+if update_raw_files:
+    response = requests.post(add_raw_files_url, headers=stream_headers, data=ndjson_gzip_body(update_raw_files))
+    response.raise_for_status()
+    print(f"Raw files update response: {response.status_code} {response.reason}")
+
+if removed_files:
+    remove_raw_files_url = 'http://localhost:8888/remove_raw_files/'
+    response = requests.post(remove_raw_files_url, headers=headers,
+                             json=[{"dataset_id": dataset_id, "path": path} for path in removed_files])
+    response.raise_for_status()
+    print(f"Raw files removal response: {response.status_code} {response.reason}")
+
+# Only now that the server has the changes does the next run skip them
+manifest.save(scan_result, linked_samples, removed_files, failed=unmatched_files, matching=matching,
+              checksums=sent_checksums, fastq_stats=sent_stats)
+manifest.close()
@@ -0,0 +1,256 @@
+import json
+import os
+import sqlite3
+
+from scanner import ScannedFile
+
+# Bumped when the tables below change; an older manifest is rebuilt
+MANIFEST_VERSION = '4'
+
+
+# What was sent for a file stays valid only while its content is unchanged
+_KEEP_IF_UNCHANGED = '''
+    md5 = CASE WHEN (files.size, files.mtime_ns, files.inode) IS (excluded.size, excluded.mtime_ns, excluded.inode)
+               THEN files.md5 END,
+    fastq_stats = CASE WHEN (files.size, files.mtime_ns, files.inode) IS (excluded.size, excluded.mtime_ns, excluded.inode)
+                       THEN files.fastq_stats END,
+'''
+
+
+class Manifest:
+    """
+    Local SQLite record of what the last tracker run saw and sent.
+
+    Stores every directory visited with its mtime and subdirectories, and
+    every matching file with its size, mtime, inode and linked sample, so the
+    next run can reuse unchanged directories and send only the differences.
+    Files whose headers could not be read are listed but not processed, and
+    are matched again next run. For each file it keeps the md5 and the kind
+    of FASTQ statistics the server has, so that only missing or outdated
+    ones are sent. It also caches file checksums by (device, inode, size,
+    mtime). A manifest written for another dataset, directory,
+    extension or manifest version is ignored and replaced.
+
+    matching is the fingerprint of the samples and settings the last run
+    matched files with (see save); when it differs every file is matched
+    again.
+    """
+
+    def __init__(self, path, dataset_id, directory, extension):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+        settings = {'dataset_id': str(dataset_id), 'directory': directory, 'extension': extension,
+                    'version': MANIFEST_VERSION}
+        stored = dict(self.conn.execute('SELECT key, value FROM settings'))
+        if {key: stored.get(key) for key in settings} != settings:
+            self.conn.executescript('''
+                DROP TABLE IF EXISTS directories;
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS checksums;
+                DELETE FROM settings;
+            ''')
+            self.conn.executemany('INSERT INTO settings (key, value) VALUES (?, ?)', settings.items())
+            stored = {}
+        self.matching = stored.get('matching')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER,
+                subdirectories TEXT
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                directory TEXT NOT NULL,
+                size INTEGER,
+                allocated INTEGER,
+                mtime_ns INTEGER,
+                inode INTEGER,
+                device INTEGER,
+                sample_id INTEGER,
+                processed INTEGER NOT NULL,
+                md5 TEXT,
+                fastq_stats TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_identity ON files (device, inode);
+            CREATE TABLE IF NOT EXISTS checksums (
+                device INTEGER,
+                inode INTEGER,
+                size INTEGER,
+                mtime_ns INTEGER,
+                md5 TEXT,
+                algorithm TEXT,
+                digest TEXT,
+                PRIMARY KEY (device, inode, size, mtime_ns)
+            );
+        ''')
+        self.conn.commit()
+
+    def listings(self):
+        """Stored directory listings in the form scanner.scan takes as previous."""
+        files = {}
+        for path, directory, size, allocated, mtime_ns, inode, device in self.conn.execute(
+            'SELECT path, directory, size, allocated, mtime_ns, inode, device FROM files'
+        ):
+            files.setdefault(directory, []).append(ScannedFile(path, size, allocated, mtime_ns, inode, device))
+        return {
+            path: (mtime_ns, json.loads(subdirectories), files.get(path, []))
+            for path, mtime_ns, subdirectories in self.conn.execute(
+                'SELECT path, mtime_ns, subdirectories FROM directories'
+            )
+        }
+
+    def files(self):
+        """
+        {path: (size, mtime_ns, inode, sample_id, processed, md5, fastq_stats)}
+        as of the last run; md5 and fastq_stats (the method) are what was sent.
+        """
+        return {
+            path: (size, mtime_ns, inode, sample_id, bool(processed), md5, fastq_stats)
+            for path, size, mtime_ns, inode, sample_id, processed, md5, fastq_stats in self.conn.execute(
+                'SELECT path, size, mtime_ns, inode, sample_id, processed, md5, fastq_stats FROM files'
+            )
+        }
+
+    def save(self, scan_result, samples, removed, failed=(), matching=None, checksums=None, fastq_stats=None):
+        """
+        Record scan_result once its changes have been sent.
+
+        samples maps the paths that were matched in this run to their
+        sample_id (None when no sample matched); other files keep the sample
+        stored for them. Paths in failed could not be matched and are
+        stored as not processed, so the next run tries them again. matching
+        is the fingerprint the files were matched with.
+
+        checksums ({path: md5}) and fastq_stats ({path: method}) are what was
+        sent for files in this run. The ones stored for a file whose size,
+        mtime or inode changed are dropped, since they describe old content.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM directories')
+        cursor.executemany(
+            'INSERT INTO directories (path, mtime_ns, subdirectories) VALUES (?, ?, ?)',
+            (
+                (path, mtime_ns, json.dumps(subdirectories))
+                for path, (mtime_ns, subdirectories, _) in scan_result.listings.items()
+                if mtime_ns is not None
+            ),
+        )
+        cursor.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in removed))
+        cursor.executemany(
+            f'''
+            INSERT INTO files (path, directory, size, allocated, mtime_ns, inode, device, sample_id, processed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT (path) DO UPDATE SET
+                directory = excluded.directory, size = excluded.size, allocated = excluded.allocated,
+                mtime_ns = excluded.mtime_ns, inode = excluded.inode, device = excluded.device,
+                {_KEEP_IF_UNCHANGED}
+                sample_id = excluded.sample_id, processed = 1
+            ''',
+            (
+                (file.path, directory, file.size, file.allocated, file.mtime_ns, file.inode, file.device,
+                 samples[file.path])
+                for directory, (_, _, files) in scan_result.listings.items()
+                for file in files
+                if file.path in samples
+            ),
+        )
+        # The server keeps whatever link a failed file had, and so does the manifest
+        failed = set(failed)
+        cursor.executemany(
+            f'''
+            INSERT INTO files (path, directory, size, allocated, mtime_ns, inode, device, sample_id, processed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, NULL, 0)
+            ON CONFLICT (path) DO UPDATE SET
+                directory = excluded.directory, size = excluded.size, allocated = excluded.allocated,
+                mtime_ns = excluded.mtime_ns, inode = excluded.inode, device = excluded.device,
+                {_KEEP_IF_UNCHANGED}
+                processed = 0
+            ''',
+            (
+                (file.path, directory, file.size, file.allocated, file.mtime_ns, file.inode, file.device)
+                for directory, (_, _, files) in scan_result.listings.items()
+                for file in files
+                if file.path in failed
+            ),
+        )
+        cursor.executemany('UPDATE files SET md5 = ? WHERE path = ?',
+                           ((md5, path) for path, md5 in (checksums or {}).items()))
+        cursor.executemany('UPDATE files SET fastq_stats = ? WHERE path = ?',
+                           ((method, path) for path, method in (fastq_stats or {}).items()))
+        if matching is not None:
+            cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('matching', ?)", (matching,))
+            self.matching = matching
+        # Checksums of content no longer on disk will not be asked for again
+        cursor.execute('''
+            DELETE FROM checksums WHERE NOT EXISTS (
+                SELECT 1 FROM files
+                WHERE files.device = checksums.device AND files.inode = checksums.inode
+                  AND files.size = checksums.size AND files.mtime_ns = checksums.mtime_ns
+            )
+        ''')
+        self.conn.commit()
+
+    def checksums(self):
+        """Cached checksums as {(device, inode, size, mtime_ns): (md5, algorithm, digest)}."""
+        return {
+            (device, inode, size, mtime_ns): (md5, algorithm, digest)
+            for device, inode, size, mtime_ns, md5, algorithm, digest in self.conn.execute(
+                'SELECT device, inode, size, mtime_ns, md5, algorithm, digest FROM checksums'
+            )
+        }
+
+    def save_checksums(self, files, checksums):
+        """Cache checksums {path: (md5, algorithm, digest)} of the ScannedFiles files."""
+        self.conn.executemany(
+            '''
+            INSERT INTO checksums (device, inode, size, mtime_ns, md5, algorithm, digest)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (device, inode, size, mtime_ns) DO UPDATE SET
+                md5 = excluded.md5, algorithm = excluded.algorithm, digest = excluded.digest
+            ''',
+            (
+                (file.device, file.inode, file.size, file.mtime_ns) + checksums[file.path]
+                for file in files
+                if file.path in checksums
+            ),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def changed_files(scan_result, known):
+    """
+    Files of scan_result that are new, differ in size, mtime or inode from
+    known, or were not processed by the last run.
+    """
+    return [
+        file for file in scan_result.files
+        if known.get(file.path, (None,) * 5)[:3] != (file.size, file.mtime_ns, file.inode)
+        or not known[file.path][4]
+    ]
+
+
+def removed_paths(scan_result, known):
+    """
+    Paths of known that are no longer in scan_result.
+
+    Files under a directory that could not be read (scan_result.failed) are
+    never taken as removed: an unreadable directory is not an empty one.
+    """
+    current = {file.path for file in scan_result.files}
+    failed = set(scan_result.failed)
+    return [path for path in known if path not in current and not _under(path, failed)]
+
+
+def _under(path, directories):
+    parent = os.path.dirname(path)
+    while parent:
+        if parent in directories:
+            return True
+        grandparent = os.path.dirname(parent)
+        if grandparent == parent:
+            return False
+        parent = grandparent
+    return False
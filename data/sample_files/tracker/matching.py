@@ -0,0 +1,200 @@
+import gzip
+import re
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# pyahocorasick is optional; it runs the same automaton in C. Without it the
+# pure Python automaton below is used.
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Longest header line read from a file in header mode
+MAX_HEADER_BYTES = 16 * 1024 * 1024
+
+
+class Automaton:
+    """
+    Aho-Corasick automaton over a set of keywords.
+
+    find() reports every keyword occurring in a text, overlapping ones
+    included, in a single pass over the text whatever the number of keywords.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = sorted(set(keyword for keyword in keywords if keyword))
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self._automaton.add_word(keyword, keyword)
+            if self.keywords:
+                self._automaton.make_automaton()
+            return
+
+        self._automaton = None
+        # Trie of goto transitions; node 0 is the root
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for keyword in self.keywords:
+            node = 0
+            for char in keyword:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                node = next_node
+            self._output[node] = (keyword,)
+
+        # Breadth first, so the failure link of a node's parent is already set
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] += self._output[self._fail[child]]
+
+    def find(self, text):
+        """Set of the keywords that occur in text."""
+        if self._automaton is not None:
+            if not self.keywords:
+                return set()
+            return {keyword for _, keyword in self._automaton.iter(text)}
+
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+def patient_pattern(ext_patient_id):
+    """
+    Regex for ext_patient_id in a filename, treating spaces as wildcards.
+    """
+    return re.compile(re.escape(ext_patient_id).replace(r'\ ', '.*'))
+
+
+class SampleMatcher:
+    """
+    Links filenames to samples by the ext_sample_id and ext_patient_id they
+    contain.
+
+    samples are the dicts returned by get_sample_data. One automaton holds
+    every ext_sample_id together with the space-separated pieces of every
+    ext_patient_id. A patient's precompiled wildcard pattern is only tried
+    when all of its pieces occur in the filename, so matching a file costs
+    one pass over its name plus a regex per plausible patient.
+    """
+
+    def __init__(self, samples):
+        self.samples = list(samples)
+        self._by_sample_id = {}
+        self._patients = {}
+        self._by_piece = {}
+        for index, sample in enumerate(self.samples):
+            if sample["ext_sample_id"]:
+                self._by_sample_id.setdefault(sample["ext_sample_id"], []).append(index)
+            patient = sample["ext_patient_id"]
+            pieces = set((patient or "").split())
+            if pieces and patient not in self._patients:
+                # A patient-only match is linked to the patient's first sample
+                self._patients[patient] = (patient_pattern(patient), len(pieces), index)
+                for piece in pieces:
+                    self._by_piece.setdefault(piece, []).append(patient)
+        self.automaton = Automaton(list(self._by_sample_id) + list(self._by_piece))
+
+    def match(self, text):
+        """
+        Every sample whose ext_sample_id occurs in text. When there is none,
+        the first sample of every patient whose ext_patient_id matches.
+        """
+        found = self.automaton.find(text)
+        matches = {index for keyword in found for index in self._by_sample_id.get(keyword, ())}
+        if not matches:
+            pieces_found = {}
+            for keyword in found:
+                for patient in self._by_piece.get(keyword, ()):
+                    pieces_found[patient] = pieces_found.get(patient, 0) + 1
+            for patient, count in pieces_found.items():
+                pattern, pieces, index = self._patients[patient]
+                if count == pieces and pattern.search(text):
+                    matches.add(index)
+        return [self.samples[index] for index in sorted(matches)]
+
+
+def read_header(path):
+    """
+    First line of path, without reading the rest of the file.
+
+    gzip files (recognised by their magic bytes) are decompressed only as
+    far as the end of the first line.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+        f.seek(0)
+        if magic == b'\x1f\x8b':
+            with gzip.GzipFile(fileobj=f) as gz:
+                line = gz.readline(MAX_HEADER_BYTES)
+        else:
+            line = f.readline(MAX_HEADER_BYTES)
+    return line.decode('utf-8', errors='replace')
+
+
+class HeaderMatcher:
+    """
+    Links files to samples by the ext_sample_ids in their first line, such as
+    the per-sample columns of a counts matrix.
+
+    The header's whitespace-separated fields are intersected with a hash of
+    all ext_sample_ids, so a file costs one pass over its header however many
+    columns and samples there are, and it links to every sample it names.
+    """
+
+    def __init__(self, samples):
+        self.samples = list(samples)
+        self._by_ext_id = {}
+        for index, sample in enumerate(self.samples):
+            if sample["ext_sample_id"]:
+                self._by_ext_id.setdefault(sample["ext_sample_id"], []).append(index)
+
+    def match(self, header):
+        """Every sample whose ext_sample_id is one of the fields of header."""
+        fields = self._by_ext_id.keys() & set(header.split())
+        matches = {index for field in fields for index in self._by_ext_id[field]}
+        return [self.samples[index] for index in sorted(matches)]
+
+    def match_file(self, path):
+        try:
+            return path, self.match(read_header(path)), None
+        # A corrupt gzip member raises zlib.error rather than OSError
+        except (OSError, EOFError, zlib.error) as e:
+            return path, [], e
+
+    def match_files(self, paths, threads=1):
+        """
+        Yield (path, samples, error) for each path, in order.
+
+        Headers are read by threads in parallel; reads and gzip inflation
+        release the GIL, so this overlaps I/O on slow filesystems.
+        """
+        if threads <= 1:
+            for path in paths:
+                yield self.match_file(path)
+            return
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            yield from executor.map(self.match_file, paths, chunksize=64)
@@ -0,0 +1,217 @@
+import os
+import threading
+from collections import deque, namedtuple
+
+# A matching file: apparent size in bytes, the space actually allocated on
+# disk, the modification time and inode used to detect changes, and the
+# device that, with the inode, identifies its content for the checksum cache
+ScannedFile = namedtuple('ScannedFile', ['path', 'size', 'allocated', 'mtime_ns', 'inode', 'device'])
+
+
+class ScanResult:
+    """
+    Everything the tracker needs from one traversal of a directory tree.
+
+    files holds a ScannedFile per matching file, and directories maps each
+    directory containing matches to [file count, apparent bytes, allocated
+    bytes] of the matches directly inside it. listings keeps every directory
+    visited as {path: (mtime_ns, subdirectories, files)} for the manifest,
+    and reused counts the directories taken from a previous scan unread.
+    failed lists the directories that could not be read completely; what is
+    known of them stands in for their contents (see _list_directory).
+    """
+
+    def __init__(self, listings=None, failed=()):
+        self.files = []
+        self.directories = {}
+        self.listings = listings or {}
+        self.failed = sorted(failed)
+        self.reused = 0
+
+    @property
+    def total_size(self):
+        return sum(file.size for file in self.files)
+
+    @property
+    def total_allocated(self):
+        return sum(file.allocated for file in self.files)
+
+
+def allocated_size(stat):
+    # st_blocks is in 512-byte units; Windows has no st_blocks
+    blocks = getattr(stat, 'st_blocks', None)
+    return stat.st_size if blocks is None else blocks * 512
+
+
+def scan(directory, extension, threads=1, previous=None):
+    """
+    Walk directory once with os.scandir, collecting files ending in extension.
+
+    Each matching file is stat'ed once through its DirEntry (which on Windows
+    is served from the directory listing itself), and subdirectories are
+    recognised from the d_type readdir already returned. Symlinked
+    directories are not followed, and unreadable directories are skipped, as
+    with os.walk. A directory that cannot be read for any other reason,
+    such as a transient NFS/Lustre error, is recorded in ScanResult.failed
+    rather than taken as empty.
+
+    With threads > 1 directories are listed by a pool of work-stealing
+    threads, which keeps several readdir/stat calls in flight; that is what
+    helps on NFS and Lustre, where each call waits on the network. The result
+    is the same whatever the thread count: directories are merged in sorted
+    order, each with its files in listing order.
+
+    previous is the listings of an earlier scan (see ScanResult.listings).
+    A directory whose mtime has not changed since then has had no entries
+    added, removed or renamed, so its stored listing is reused instead of
+    reading it and stat'ing its files again; only its subdirectories are
+    visited. Files rewritten in place keep their stored size and mtime until
+    a scan without previous.
+    """
+    previous = previous or {}
+    if threads > 1:
+        listings, failed = _scan_parallel(directory, extension, threads, previous)
+    else:
+        listings = {}
+        failed = []
+        stack = [directory]
+        while stack:
+            path = stack.pop()
+            listings[path], path_failed = _list_directory(path, extension, previous)
+            if path_failed:
+                failed.append(path)
+            stack.extend(listings[path][1])
+
+    result = ScanResult(listings, failed)
+    for path in sorted(listings):
+        mtime_ns, _, files = listings[path]
+        if mtime_ns is not None and previous.get(path, (None,))[0] == mtime_ns:
+            result.reused += 1
+        for file in files:
+            _add_file(result, path, file)
+    return result
+
+
+def _list_directory(path, extension, previous):
+    """
+    List path as (mtime_ns, subdirectories, files), and whether that failed.
+
+    A directory that has gone is listed as empty. One that cannot be read
+    for another reason, as a whole or for some of its entries, has failed:
+    its stored listing stands in for what could not be read, and mtime_ns
+    is None so that it is read again next time.
+    """
+    stored = previous.get(path)
+    try:
+        # Taken before listing, so a change made while listing is seen next time
+        mtime_ns = os.stat(path).st_mtime_ns
+        if stored is not None and stored[0] == mtime_ns:
+            return stored, False
+        entries = os.scandir(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return (None, [], []), False
+    except OSError:
+        return _stored_listing(stored), True
+
+    stored_files = {file.path: file for file in stored[2]} if stored is not None else {}
+    subdirectories = []
+    files = []
+    failed = False
+    try:
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif entry.name.endswith(extension) and entry.is_file():
+                        stat = entry.stat()
+                        files.append(ScannedFile(entry.path, stat.st_size, allocated_size(stat),
+                                                 stat.st_mtime_ns, stat.st_ino, stat.st_dev))
+                except FileNotFoundError:
+                    # Removed while scanning
+                    continue
+                except OSError:
+                    failed = True
+                    if entry.path in stored_files:
+                        files.append(stored_files[entry.path])
+    except OSError:
+        # Reading the directory itself failed part way through
+        return _stored_listing(stored), True
+    return (None if failed else mtime_ns, subdirectories, files), failed
+
+
+def _stored_listing(stored):
+    if stored is None:
+        return None, [], []
+    return None, stored[1], stored[2]
+
+
+def _scan_parallel(directory, extension, threads, previous):
+    """
+    List every directory under directory with a work-stealing thread pool.
+
+    Each worker takes directories from the end of its own deque, so it goes
+    depth first through the subtree it discovered, and when that runs out it
+    steals from the front of another worker's deque, where the largest
+    unexplored subtrees are. Returns ({directory: (mtime_ns, subdirectories,
+    files)}, [directories that failed]).
+    """
+    deques = [deque() for _ in range(threads)]
+    deques[0].append(directory)
+    listings = {}
+    failed = []
+    condition = threading.Condition()
+    # Directories queued or being listed; the scan is done when it reaches 0
+    pending = 1
+
+    def take(index):
+        if deques[index]:
+            return deques[index].pop()
+        for offset in range(1, threads):
+            victim = deques[(index + offset) % threads]
+            if victim:
+                return victim.popleft()
+        return None
+
+    def worker(index):
+        nonlocal pending
+        while True:
+            with condition:
+                path = take(index)
+                while path is None:
+                    if pending == 0:
+                        return
+                    condition.wait()
+                    path = take(index)
+
+            try:
+                listing, path_failed = _list_directory(path, extension, previous)
+            except Exception:
+                listing, path_failed = _stored_listing(previous.get(path)), True
+            subdirectories = listing[1]
+
+            with condition:
+                listings[path] = listing
+                if path_failed:
+                    failed.append(path)
+                deques[index].extend(subdirectories)
+                pending += len(subdirectories) - 1
+                if subdirectories or pending == 0:
+                    condition.notify_all()
+
+    workers = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return listings, failed
+
+
+def _add_file(result, directory, file):
+    result.files.append(file)
+    totals = result.directories.get(directory)
+    if totals is None:
+        totals = result.directories[directory] = [0, 0, 0]
+    totals[0] += 1
+    totals[1] += file.size
+    totals[2] += file.allocated
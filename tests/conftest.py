@@ -0,0 +1,21 @@
+import os
+import tempfile
+
+import pytest
+
+# app.main builds its database when it is imported, so the app is pointed at
+# a scratch database before any app module is loaded
+os.environ.setdefault("REDMANE_DATABASE", os.path.join(tempfile.mkdtemp(prefix="redmane-tests-"), "redmane.db"))
+
+from app.db import database  # noqa: E402
+# Shared with the benchmarks, so both seed the same data; tests import it from here
+from benchmarks.common import seed_project  # noqa: E402,F401
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Path of a fresh database with the schema built by init_db."""
+    path = str(tmp_path / "redmane.db")
+    monkeypatch.setattr(database, "DATABASE", path)
+    database.init_db()
+    return path
@@ -0,0 +1,97 @@
+"""
+/projects/ must stay responsive while heavy requests are in flight: queries
+run off the event loop, and cache hits never wait on the writer thread.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.db import database
+from app.db.ingest import upsert_raw_files
+from app.db.pool import pool
+from app.main import app
+from conftest import seed_project
+
+# Patients of the project /patients_metadata/0 is asked for
+PATIENTS = 20000
+
+# Files written by the bulk write
+BULK_FILES = 200000
+
+
+@pytest.fixture(scope="module")
+def seeded_client():
+    project_id, dataset_id = seed_project(database.DATABASE, PATIENTS)
+    with TestClient(app) as client:
+        # Warm the cache, so /projects/ is answered from it from now on
+        client.get("/projects/")
+        yield client, project_id, dataset_id
+
+
+def get_latency(client, url):
+    start = time.perf_counter()
+    assert client.get(url).status_code == 200
+    return time.perf_counter() - start
+
+
+def p99(latencies):
+    latencies = sorted(latencies)
+    return latencies[max(int(len(latencies) * 0.99) - 1, 0)]
+
+
+def test_projects_p99_flat_while_patients_metadata_runs(seeded_client):
+    client, project_id, _ = seeded_client
+    idle = p99([get_latency(client, "/projects/") for _ in range(100)])
+    heavy = get_latency(client, f"/patients_metadata/0?project_id={project_id}")
+
+    stop = threading.Event()
+
+    def run_heavy(worker):
+        number = 0
+        while not stop.is_set():
+            # A query string of its own, so requests are not coalesced
+            number += 1
+            client.get(f"/patients_metadata/0?project_id={project_id}&run={worker}-{number}")
+
+    threads = [threading.Thread(target=run_heavy, args=(worker,)) for worker in range(2)]
+    for thread in threads:
+        thread.start()
+    try:
+        time.sleep(0.2)
+        busy = p99([get_latency(client, "/projects/") for _ in range(100)])
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    # A blocked event loop would hold /projects/ for a whole heavy request
+    assert busy < heavy / 2, f"/projects/ p99 {busy * 1000:.0f} ms (idle {idle * 1000:.0f} ms) " \
+                             f"while /patients_metadata/0 takes {heavy * 1000:.0f} ms"
+
+
+def test_projects_p99_flat_during_bulk_write(seeded_client):
+    client, _, dataset_id = seeded_client
+    rows = [(dataset_id, f"/bulk/{number}.fastq", None, [("md5", "0" * 32)]) for number in range(BULK_FILES)]
+    write_time = []
+
+    def bulk_write():
+        start = time.perf_counter()
+        asyncio.run(pool.write(upsert_raw_files, rows))
+        write_time.append(time.perf_counter() - start)
+
+    writer = threading.Thread(target=bulk_write)
+    writer.start()
+    time.sleep(0.1)
+    latencies = []
+    while writer.is_alive():
+        latencies.append(get_latency(client, "/projects/"))
+    writer.join()
+
+    assert latencies
+    busy = p99(latencies)
+    # A cache hit waiting on the writer would take about as long as the write
+    assert busy < write_time[0] / 2, f"/projects/ p99 {busy * 1000:.0f} ms " \
+                                     f"during a {write_time[0] * 1000:.0f} ms write"
@@ -0,0 +1,65 @@
+"""
+ETags of /patients/ must change exactly when the project's rows change, and
+a body is only ever sent under the ETag of the rows it was built from,
+including after a write made by another process.
+"""
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.db import database
+from app.main import app
+from conftest import seed_project
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def project_id():
+    project_id, _ = seed_project(database.DATABASE, 5)
+    return project_id
+
+
+def test_unchanged_rows_revalidate_to_304(client, project_id):
+    url = f"/patients/?project_id={project_id}"
+    first = client.get(url)
+    etag = first.headers["etag"]
+
+    assert client.get(url).headers["etag"] == etag
+    revalidated = client.get(url, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
+
+
+def test_ndjson_has_its_own_etag(client, project_id):
+    url = f"/patients/?project_id={project_id}"
+    etag = client.get(url).headers["etag"]
+    ndjson = client.get(url, headers={"Accept": "application/x-ndjson"})
+
+    assert ndjson.headers["etag"] != etag
+    assert client.get(url, headers={"Accept": "application/x-ndjson", "If-None-Match": etag}).status_code == 200
+
+
+def test_outside_write_then_revalidate(client, project_id):
+    url = f"/patients/?project_id={project_id}"
+    stale = client.get(url)
+    assert len(stale.json()) == 5
+
+    # An import script adding a patient, as another process; the request
+    # below comes before the pool's writer thread polls data_version again
+    conn = sqlite3.connect(database.DATABASE)
+    conn.execute("INSERT INTO patients (project_id, ext_patient_id) VALUES (?, 'outside')", (project_id,))
+    conn.commit()
+    conn.close()
+
+    fresh = client.get(url)
+    assert fresh.headers["etag"] != stale.headers["etag"]
+    assert len(fresh.json()) == 6
+
+    assert client.get(url, headers={"If-None-Match": stale.headers["etag"]}).status_code == 200
+    assert client.get(url, headers={"If-None-Match": fresh.headers["etag"]}).status_code == 304
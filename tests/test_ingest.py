@@ -0,0 +1,197 @@
+"""
+Raw file ingestion: upsert counts, streamed and gzip-compressed manifests,
+metadata upserts, sample_id validation and the migration of the old
+sample_id metadata rows to the raw_files.sample_id column.
+"""
+import asyncio
+import gzip
+import json
+import sqlite3
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+from app.api import routes
+from app.api.streaming import ndjson_records
+from app.db import database
+from app.main import app
+from conftest import seed_project
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def dataset_id():
+    _, dataset_id = seed_project(database.DATABASE, 1)
+    return dataset_id
+
+
+def raw_file(dataset_id, path, sample_id=None, metadata=()):
+    record = {"dataset_id": dataset_id, "path": path,
+              "metadata": [{"metadata_key": key, "metadata_value": value} for key, value in metadata]}
+    if sample_id is not None:
+        record["sample_id"] = sample_id
+    return record
+
+
+def query(sql, *params):
+    conn = sqlite3.connect(database.DATABASE)
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return rows
+
+
+def file_metadata(dataset_id, path):
+    return query('''
+        SELECT m.metadata_key, m.metadata_value
+        FROM raw_files_metadata m JOIN raw_files rf ON rf.id = m.raw_file_id
+        WHERE rf.dataset_id = ? AND rf.path = ?
+        ORDER BY m.metadata_key
+    ''', dataset_id, path)
+
+
+def counts(response):
+    assert response.status_code == 200, response.text
+    body = response.json()
+    return body["inserted"], body["updated"], body["unchanged"]
+
+
+def test_same_files_twice_are_unchanged(client, dataset_id):
+    files = [raw_file(dataset_id, f"/same/{number}.fastq", metadata=[("md5", str(number))]) for number in range(3)]
+
+    assert counts(client.post("/add_raw_files/", json=files)) == (3, 0, 0)
+    assert counts(client.post("/add_raw_files/", json=files)) == (0, 0, 3)
+
+
+def test_changed_sample_id_or_metadata_is_updated(client, dataset_id):
+    first, second = [row[0] for row in query("SELECT id FROM samples ORDER BY id DESC LIMIT 2")]
+    files = [
+        raw_file(dataset_id, "/linked.fastq", sample_id=first),
+        raw_file(dataset_id, "/checked.fastq", metadata=[("md5", "old")]),
+        raw_file(dataset_id, "/kept.fastq", metadata=[("md5", "kept")]),
+    ]
+    client.post("/add_raw_files/", json=files)
+
+    files[0] = raw_file(dataset_id, "/linked.fastq", sample_id=second)
+    files[1] = raw_file(dataset_id, "/checked.fastq", metadata=[("md5", "new")])
+    assert counts(client.post("/add_raw_files/", json=files)) == (0, 2, 1)
+    assert query("SELECT sample_id FROM raw_files WHERE dataset_id = ? AND path = '/linked.fastq'",
+                 dataset_id) == [(second,)]
+    assert file_metadata(dataset_id, "/checked.fastq") == [("md5", "new")]
+
+
+def test_duplicate_file_in_one_request_is_written_once(client, dataset_id):
+    files = [raw_file(dataset_id, "/twice.fastq", metadata=[("md5", "first")]),
+             raw_file(dataset_id, "/twice.fastq", metadata=[("md5", "second")])]
+
+    assert counts(client.post("/add_raw_files/", json=files)) == (1, 0, 0)
+    assert query("SELECT COUNT(*) FROM raw_files WHERE dataset_id = ? AND path = '/twice.fastq'",
+                 dataset_id) == [(1,)]
+    # The later one wins
+    assert file_metadata(dataset_id, "/twice.fastq") == [("md5", "second")]
+
+
+def gzip_manifest(dataset_id, paths):
+    return gzip.compress("\n".join(json.dumps(raw_file(dataset_id, path, metadata=[("description", "naïve read")]))
+                                   for path in paths).encode())
+
+
+def test_gzip_ndjson_split_across_chunks():
+    body = gzip_manifest(1, [f"/streamed/{number}.fastq" for number in range(5)])
+    # Small enough to split the gzip header, lines and multi-byte characters
+    messages = [{"type": "http.request", "body": body[start:start + 7], "more_body": True}
+                for start in range(0, len(body), 7)]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        return messages.pop(0)
+
+    async def records():
+        request = Request({"type": "http", "method": "POST", "headers": [(b"content-encoding", b"gzip")]}, receive)
+        return [item async for item in ndjson_records(request)]
+
+    assert asyncio.run(records()) == [
+        (number + 1, raw_file(1, f"/streamed/{number}.fastq", metadata=[("description", "naïve read")]))
+        for number in range(5)]
+
+
+def test_gzip_stream_commits_in_chunks(client, dataset_id, monkeypatch):
+    # Commit every two files, so the five below take three transactions
+    monkeypatch.setattr(routes, "INGEST_CHUNK_SIZE", 2)
+    paths = [f"/streamed/{number}.fastq" for number in range(5)]
+
+    response = client.post("/add_raw_files/stream", content=gzip_manifest(dataset_id, paths),
+                           headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"})
+    assert counts(response) == (5, 0, 0)
+    for path in paths:
+        assert file_metadata(dataset_id, path) == [("description", "naïve read")]
+
+
+def test_duplicate_metadata_key_is_written_once(client, dataset_id):
+    patient_id = query("SELECT MAX(id) FROM patients")[0][0]
+    metadata = [{"entity_id": patient_id, "key": "diagnosis", "value": "none"}] * 2
+
+    assert client.put("/metadata/patients", json=metadata).json() == {
+        "status": "success", "written": 1, "unchanged": 1}
+    assert client.put("/metadata/patients", json=metadata).json() == {
+        "status": "success", "written": 0, "unchanged": 2}
+    assert query("SELECT value FROM patients_metadata WHERE patient_id = ? AND key = 'diagnosis'",
+                 patient_id) == [("none",)]
+
+
+@pytest.mark.parametrize("value", ["²", "١٢", str(2 ** 63)], ids=["superscript", "arabic_indic", "too_large"])
+def test_invalid_sample_id_metadata_is_rejected(client, dataset_id, value):
+    response = client.post("/add_raw_files/", json=[raw_file(dataset_id, "/invalid.fastq",
+                                                             metadata=[("sample_id", value)])])
+    assert response.status_code == 422
+
+
+def test_out_of_range_sample_id_is_rejected(client, dataset_id):
+    response = client.post("/add_raw_files/", json=[raw_file(dataset_id, "/invalid.fastq", sample_id=2 ** 63)])
+    assert response.status_code == 422
+
+
+def test_invalid_sample_id_in_stream_is_rejected(client, dataset_id):
+    body = "\n".join([
+        '{"dataset_id": %d, "path": "/first.fastq"}' % dataset_id,
+        '{"dataset_id": %d, "path": "/second.fastq", '
+        '"metadata": [{"metadata_key": "sample_id", "metadata_value": "\\u00b2"}]}' % dataset_id,
+    ])
+    response = client.post("/add_raw_files/stream", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 422
+    assert response.json()["detail"] == "Invalid sample_id for /second.fastq"
+
+
+def test_sample_id_metadata_moves_to_column(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    # raw_files as it was before the sample_id column
+    conn.executescript('''
+        CREATE TABLE raw_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dataset_id INTEGER NOT NULL,
+            path TEXT
+        );
+        CREATE TABLE raw_files_metadata (
+            metadata_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            raw_file_id INTEGER,
+            metadata_key TEXT NOT NULL,
+            metadata_value TEXT NOT NULL
+        );
+        INSERT INTO raw_files (dataset_id, path) VALUES (1, '/linked.fastq'), (1, '/invalid.fastq');
+        INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value)
+        VALUES (1, 'sample_id', '7'), (1, 'md5', 'abc'), (2, 'sample_id', 'abc');
+    ''')
+    conn.commit()
+    monkeypatch.setattr(database, "DATABASE", path)
+    database.init_db()
+
+    assert conn.execute("SELECT path, sample_id FROM raw_files ORDER BY id").fetchall() == [
+        ("/linked.fastq", 7), ("/invalid.fastq", None)]
+    assert conn.execute("SELECT raw_file_id, metadata_key FROM raw_files_metadata").fetchall() == [(1, "md5")]
+    conn.close()
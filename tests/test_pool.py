@@ -0,0 +1,87 @@
+"""
+Group commits: a write that fails inside a group is rolled back to its own
+savepoint, and the rest of the group is still committed.
+"""
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+from app.db.pool import ConnectionPool
+
+
+def add_project(conn, name):
+    conn.execute("INSERT INTO projects (name, status) VALUES (?, 'Active')", (name,))
+    conn.commit()
+
+
+def add_project_then_fail(conn, name):
+    conn.execute("INSERT INTO projects (name, status) VALUES (?, 'Active')", (name,))
+    # name is NOT NULL
+    conn.execute("INSERT INTO projects (name, status) VALUES (NULL, 'Active')")
+
+
+def add_project_then_roll_back(conn, name):
+    conn.execute("INSERT INTO projects (name, status) VALUES (?, 'Active')", (name,))
+    conn.rollback()
+
+
+def test_failed_write_only_rolls_back_itself(db_path):
+    pool = ConnectionPool(db_path)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block(conn):
+        # Holds the writer so the writes below queue up into one group
+        started.set()
+        release.wait()
+
+    async def writes():
+        blocker = asyncio.ensure_future(pool.write(block))
+        await asyncio.to_thread(started.wait)
+        group = [
+            asyncio.ensure_future(pool.write(add_project, "first")),
+            asyncio.ensure_future(pool.write(add_project_then_fail, "failed")),
+            asyncio.ensure_future(pool.write(add_project, "second")),
+            asyncio.ensure_future(pool.write(add_project_then_roll_back, "rolled back")),
+            asyncio.ensure_future(pool.write(add_project, "third")),
+        ]
+        # Let every write reach the queue before the writer is released
+        await asyncio.sleep(0.1)
+        release.set()
+        await blocker
+        return await asyncio.gather(*group, return_exceptions=True)
+
+    try:
+        results = asyncio.run(writes())
+    finally:
+        pool.close_all()
+
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert [result for index, result in enumerate(results) if index != 1] == [None] * 4
+    # The blocking write, then the other five in a single commit
+    assert (pool.group_commits, pool.grouped_writes) == (2, 6)
+
+    conn = sqlite3.connect(db_path)
+    names = [row[0] for row in conn.execute("SELECT name FROM projects ORDER BY id")]
+    conn.close()
+    assert names == ["first", "second", "third"]
+
+
+@pytest.mark.parametrize("group_size", [1, 64])
+def test_every_write_is_committed(db_path, group_size):
+    pool = ConnectionPool(db_path, max_group_size=group_size)
+
+    async def writes():
+        await asyncio.gather(*(pool.write(add_project, f"project{number}") for number in range(100)))
+
+    try:
+        asyncio.run(writes())
+    finally:
+        pool.close_all()
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM projects").fetchone()[0] == 100
+    conn.close()
+    assert pool.grouped_writes == 100
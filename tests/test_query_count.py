@@ -0,0 +1,36 @@
+"""
+The patients_metadata tree must be built with a fixed number of queries,
+however many patients the project has.
+"""
+import sqlite3
+
+import pytest
+
+from app.api.routes import _get_patients_metadata
+from conftest import seed_project
+
+
+def traced_call(path, fn, *args):
+    """Result of fn(conn, *args) and the statements it executed."""
+    conn = sqlite3.connect(path)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        return fn(conn, *args), statements
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("after, limit", [(None, None), (0, 500)])
+def test_patients_metadata_query_count_does_not_depend_on_patients(db_path, after, limit):
+    counts = {}
+    for patients in (10, 1000):
+        project_id, _ = seed_project(db_path, patients)
+        tree, statements = traced_call(db_path, _get_patients_metadata, project_id, 0, after, limit)
+
+        assert len(tree) == min(patients, limit or patients)
+        assert all(len(patient['samples']) == 2 and len(patient['metadata']) == 2 for patient in tree)
+        assert all(len(sample['metadata']) == 2 for patient in tree for sample in patient['samples'])
+        counts[patients] = len(statements)
+
+    assert counts[10] == counts[1000] == 2, counts
@@ -0,0 +1,120 @@
+"""
+Every filtered statement of the routes and the write path must be answered
+from an index: no query plan may read a whole table.
+"""
+import re
+import sqlite3
+
+import pytest
+
+from app.api import routes
+from app.api.etag import PATIENTS_METADATA_TABLES, _change_versions
+from app.db.ingest import delete_raw_files, upsert_metadata, upsert_raw_files
+from conftest import seed_project
+
+# Tables in FROM and JOIN clauses with their aliases
+_TABLE_ALIAS = re.compile(r'\b(?:FROM|JOIN)\s+([\w.]+)\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b)(\w+)', re.IGNORECASE)
+
+# (function, arguments) per case, the arguments built from the seeded ids;
+# statements without a WHERE clause, like the project list, are left out
+READS = {
+    'patients_metadata': (routes._get_patients_metadata, lambda ids: (ids['project'], 0)),
+    'patients_metadata_one': (routes._get_patients_metadata, lambda ids: (ids['project'], ids['patient'])),
+    'patients_metadata_page': (routes._get_patients_metadata, lambda ids: (ids['project'], 0, ids['patient'], 10)),
+    'samples': (routes._get_samples_per_patient, lambda ids: (0, ids['project'])),
+    'samples_one': (routes._get_samples_per_patient, lambda ids: (ids['sample'], ids['project'])),
+    'samples_page': (routes._get_samples_per_patient, lambda ids: (0, ids['project'], ids['sample'], 10)),
+    'patients': (routes._get_patients, lambda ids: (ids['project'],)),
+    'patients_page': (routes._get_patients, lambda ids: (ids['project'], ids['patient'], 10)),
+    'datasets': (routes._get_datasets, lambda ids: (ids['project'], None)),
+    'datasets_one': (routes._get_datasets, lambda ids: (ids['project'], ids['dataset'])),
+    'dataset_with_metadata': (routes._get_dataset_with_metadata, lambda ids: (ids['dataset'], ids['project'])),
+    'raw_files_with_metadata': (routes._get_raw_files_with_metadata, lambda ids: (ids['dataset'],)),
+    'raw_files_with_metadata_page': (routes._get_raw_files_with_metadata, lambda ids: (ids['dataset'], 1, 10)),
+    'change_versions': (_change_versions, lambda ids: (ids['project'], PATIENTS_METADATA_TABLES)),
+    'change_versions_all': (_change_versions, lambda ids: (None, PATIENTS_METADATA_TABLES)),
+}
+
+WRITES = {
+    'upsert_raw_files': (upsert_raw_files, lambda ids: ([
+        (ids['dataset'], f"/data/{ids['project']}/0/0.fastq", ids['sample'], [('md5', '0' * 32)]),
+        (ids['dataset'], '/data/new.fastq', None, [('md5', '1' * 32)]),
+    ],)),
+    'delete_raw_files': (delete_raw_files, lambda ids: ([(ids['dataset'], f"/data/{ids['project']}/0/1.fastq")],)),
+    'upsert_datasets_metadata': (upsert_metadata, lambda ids: ('datasets', [(ids['dataset'], 'key0', 'new')])),
+    'upsert_patients_metadata': (upsert_metadata, lambda ids: ('patients', [(ids['patient'], 'key0', 'new')])),
+    'upsert_samples_metadata': (upsert_metadata, lambda ids: ('samples', [(ids['sample'], 'key0', 'new')])),
+    'upsert_raw_files_metadata': (upsert_metadata, lambda ids: ('raw_files', [(1, 'md5', '2' * 32)])),
+}
+
+
+@pytest.fixture
+def seeded(db_path):
+    # A second project, so that filtering on the project means something
+    seed_project(db_path, 50)
+    project_id, dataset_id = seed_project(db_path, 50)
+    conn = sqlite3.connect(db_path)
+    patient_id, sample_id = conn.execute('''
+        SELECT p.id, s.id FROM patients p JOIN samples s ON s.patient_id = p.id
+        WHERE p.project_id = ? ORDER BY s.id LIMIT 1
+    ''', (project_id,)).fetchone()
+    ids = {'project': project_id, 'dataset': dataset_id, 'patient': patient_id, 'sample': sample_id}
+    try:
+        yield conn, ids
+    finally:
+        conn.close()
+
+
+def executed_statements(conn, fn, *args):
+    """The distinct statements fn(conn, *args) executed, with their values bound."""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        fn(conn, *args)
+    finally:
+        conn.set_trace_callback(None)
+    return list(dict.fromkeys(statements))
+
+
+def full_scans(conn, statement):
+    """Tables the plan of statement reads in full."""
+    plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + statement)]
+    # Subqueries in FROM are built first and then scanned; that scan reads
+    # the rows the subquery found, not a table
+    derived = {detail.split()[1] for detail in plan if detail.startswith(('CO-ROUTINE', 'MATERIALIZE'))}
+    tables = {alias: table for table, alias in _TABLE_ALIAS.findall(statement)}
+    scans = []
+    for detail in plan:
+        match = re.match(r'SCAN (\S+)', detail)
+        if not match or match.group(1) in derived or match.group(1) == 'CONSTANT':
+            continue
+        table = tables.get(match.group(1), match.group(1))
+        # The staged rows of a request are merged in full by design
+        if not table.startswith('temp.ingest_'):
+            scans.append(detail)
+    return scans
+
+
+@pytest.mark.parametrize("case", READS)
+def test_reads_use_indexes(seeded, case):
+    conn, ids = seeded
+    fn, args = READS[case]
+    statements = executed_statements(conn, fn, *args(ids))
+
+    assert statements
+    for statement in statements:
+        assert not full_scans(conn, statement), statement
+
+
+@pytest.mark.parametrize("case", WRITES)
+def test_writes_use_indexes(seeded, case):
+    conn, ids = seeded
+    fn, args = WRITES[case]
+    try:
+        statements = executed_statements(conn, fn, *args(ids))
+
+        assert statements
+        for statement in statements:
+            assert not full_scans(conn, statement), statement
+    finally:
+        conn.rollback()